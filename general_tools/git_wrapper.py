@@ -14,6 +14,7 @@ import os
 import sys
 import json
 import shlex
+import instrument
 from subprocess import *
 
 
@@ -80,8 +81,9 @@ def gitCommit(d, msg):
     Adds all files in d and commits with message m.
     '''
     os.chdir(d)
-    out, ret = runCommand('git add *')
-    out1, ret1= runCommand('''git commit -am "{0}" '''.format(msg))
+    with instrument.span('git_commit'):
+        out, ret = runCommand('git add *')
+        out1, ret1= runCommand('''git commit -am "{0}" '''.format(msg))
     if ret > 0 or ret1 > 0:
         print 'Nothing to commit, or failed commit to repo in: {0}'.format(d)
         print out1
@@ -91,7 +93,8 @@ def gitPush(d):
     Pushes local repository to origin master.
     '''
     os.chdir(d)
-    out, ret = runCommand('git push origin master')
+    with instrument.span('git_push'):
+        out, ret = runCommand('git push origin master')
     if ret > 0:
         print out
         print 'Failed to push repo to origin master in: {0}'.format(d)
@@ -101,7 +104,8 @@ def gitPull(d):
     Pulls from origin master to local repository.
     '''
     os.chdir(d)
-    out, ret = runCommand('git pull --no-edit origin master')
+    with instrument.span('git_pull'):
+        out, ret = runCommand('git pull --no-edit origin master')
     if ret > 0:
         print out
         print 'Failed to pull from origin master in: {0}'.format(d)
@@ -128,6 +132,7 @@ def runCommand(c):
     Runs a command in a shell.  Returns output and return code of command.
     '''
     command = shlex.split(c)
+    instrument.count('subprocesses')
     com = Popen(command, shell=False, stdout=PIPE, stderr=PIPE)
     comout = ''.join(com.communicate()).strip()
     return comout, com.returncode
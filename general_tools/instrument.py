@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#  Copyright (c) 2014 unfoldingWord
+#  http://creativecommons.org/licenses/MIT/
+#  See LICENSE file for details.
+#
+#  Contributors:
+#  Jesse Griffin <jesse@distantshores.org>
+#
+
+'''
+Timing spans and counters shared by the export tools.
+
+Nothing is recorded until enable() is called, until then span() and count()
+return straight away.  Records are kept per stage and per language:
+
+    with instrument.span('parse', lang):
+        ...
+        instrument.count('files_read')
+
+A counter is charged to the innermost open span, and a span without a
+language inherits the one of the span around it.  Span times include the
+spans nested in them.  At the end of a run writeSummary writes the records
+as JSON, or in the Prometheus textfile format if the path ends in .prom.
+'''
+
+import os
+import json
+import time
+import codecs
+from contextlib import contextmanager
+
+enabled = False
+tool = None
+records = {}
+spans = []
+promprefix = 'door43_export'
+
+
+def enable(toolname):
+    global enabled, tool
+    enabled = True
+    tool = toolname
+
+def reset():
+    '''
+    Drops the records, e.g. in a worker process forked after some were made.
+    '''
+    records.clear()
+
+def getRecord(stage, lang):
+    key = (stage, lang)
+    if key not in records:
+        records[key] = { 'seconds': 0.0,
+                         'calls': 0,
+                         'counters': {},
+                       }
+    return records[key]
+
+@contextmanager
+def span(stage, lang=None):
+    '''
+    Times the block as a call of stage for lang.
+    '''
+    if not enabled:
+        yield
+        return
+    if lang is None and spans:
+        lang = spans[-1][1]
+    spans.append((stage, lang))
+    start = time.time()
+    try:
+        yield
+    finally:
+        spans.pop()
+        rec = getRecord(stage, lang)
+        rec['seconds'] += time.time() - start
+        rec['calls'] += 1
+
+def count(name, n=1):
+    '''
+    Adds n to the counter name of the innermost open span.
+    '''
+    if not enabled:
+        return
+    stage, lang = ('main', None)
+    if spans:
+        stage, lang = spans[-1]
+    counters = getRecord(stage, lang)['counters']
+    counters[name] = counters.get(name, 0) + n
+
+def countBytes(name, p):
+    '''
+    Adds the UTF-8 length of p to the counter name.  The text is only
+    encoded when recording is enabled.
+    '''
+    if not enabled:
+        return
+    if isinstance(p, unicode):
+        p = p.encode('utf-8')
+    count(name, len(p))
+
+def collect():
+    '''
+    Returns the records as a list and drops them, so that a worker process
+    can hand them back to be merged by the parent.
+    '''
+    recs = getRecords()
+    reset()
+    return recs
+
+def merge(recs):
+    '''
+    Adds the records returned by collect() in another process.
+    '''
+    if not enabled or not recs:
+        return
+    for r in recs:
+        rec = getRecord(r['stage'], r['language'])
+        rec['seconds'] += r['seconds']
+        rec['calls'] += r['calls']
+        for k, v in r['counters'].iteritems():
+            rec['counters'][k] = rec['counters'].get(k, 0) + v
+
+def getRecords():
+    recs = []
+    for (stage, lang), rec in sorted(records.iteritems()):
+        recs.append({ 'stage': stage,
+                      'language': lang,
+                      'seconds': rec['seconds'],
+                      'calls': rec['calls'],
+                      'counters': dict(rec['counters']),
+                    })
+    return recs
+
+def getJSONSummary():
+    return json.dumps({ 'tool': tool,
+                        'time': int(time.time()),
+                        'records': getRecords(),
+                      }, sort_keys=True, indent=2)
+
+def getLabels(rec):
+    labels = [u'tool="{0}"'.format(tool), u'stage="{0}"'.format(rec['stage'])]
+    if rec['language'] is not None:
+        labels.append(u'language="{0}"'.format(rec['language']))
+    return u','.join(labels)
+
+def getPromSummary():
+    '''
+    Returns the records in the Prometheus text format, one gauge for span
+    seconds and calls and one for each counter.
+    '''
+    metrics = {}
+    for rec in getRecords():
+        labels = getLabels(rec)
+        values = [('seconds', rec['seconds']), ('calls', rec['calls'])]
+        values.extend(sorted(rec['counters'].iteritems()))
+        for name, value in values:
+            metrics.setdefault(name, []).append(u'{0}_{1}{{{2}}} {3}'.format(
+                                          promprefix, name, labels, value))
+    lines = []
+    for name in sorted(metrics):
+        lines.append(u'# TYPE {0}_{1} gauge'.format(promprefix, name))
+        lines.extend(metrics[name])
+    lines.append(u'# TYPE {0}_last_run_time gauge'.format(promprefix))
+    lines.append(u'{0}_last_run_time{{tool="{1}"}} {2}'.format(promprefix,
+                                                   tool, int(time.time())))
+    return u'\n'.join(lines) + u'\n'
+
+def writeSummary(path):
+    '''
+    Writes everything recorded to path, atomically so that a textfile
+    collector never reads half a file.
+    '''
+    if not enabled:
+        return
+    if path.endswith('.prom'):
+        summary = getPromSummary()
+    else:
+        summary = getJSONSummary()
+    makeDir(os.path.dirname(os.path.abspath(path)))
+    tmpfile = '{0}.{1}.tmp'.format(path, os.getpid())
+    f = codecs.open(tmpfile, 'w', encoding='utf-8')
+    f.write(summary)
+    f.close()
+    os.rename(tmpfile, path)
+
+def makeDir(d):
+    if not os.path.exists(d):
+        os.makedirs(d, 0755)
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#  Copyright (c) 2014 unfoldingWord
+#  http://creativecommons.org/licenses/MIT/
+#  See LICENSE file for details.
+#
+#  Contributors:
+#  Jesse Griffin <jesse@distantshores.org>
+#
+
+'''
+Runs the OBS exporters end to end against a synthetic Door43 tree.
+
+A tree is generated with make_corpus, then json_export, json_tn_export,
+reveal_export and export.py are run against it with their roots pointed into
+the benchmark directory.  Each stage runs in its own process, and the wall
+time, peak RSS and number of files written are reported for each.  Nothing
+touches the network, Github or /var/www.
+'''
+
+import os
+import sys
+import json
+import shutil
+import datetime
+import argparse
+import tempfile
+import traceback
+
+toolsdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(toolsdir), 'general_tools'))
+sys.path.append(os.path.join(toolsdir, 'json'))
+sys.path.append(os.path.join(toolsdir, 'js'))
+sys.path.append(toolsdir)
+import make_corpus
+
+
+def getPaths(root):
+    out = os.path.join(root, 'out')
+    return { 'root': root,
+             'pages': os.path.join(root, 'gitrepo', 'pages'),
+             'langnames': os.path.join(root, 'langnames.txt'),
+             'out': out,
+             'exports': os.path.join(out, 'exports'),
+             'cache': os.path.join(out, 'cache'),
+             'api': os.path.join(out, 'api'),
+             'www': os.path.join(out, 'www'),
+             'formats': os.path.join(out, 'formats'),
+           }
+
+def runJSONExport(paths, opts):
+    import json_export
+    json_export.root = os.path.join(paths['root'], 'gitrepo')
+    json_export.pages = paths['pages']
+    json_export.uwadmindir = os.path.join(paths['pages'], 'en/uwadmin')
+    json_export.exportdir = paths['exports']
+    json_export.cachedir = paths['cache']
+    json_export.unfoldingWorddir = paths['api']
+    json_export.langnames = paths['langnames']
+    json_export.runExport(getToday(), opts)
+
+def runTNExport(paths, opts):
+    import json_tn_export
+    json_tn_export.pages = paths['pages']
+    json_tn_export.api = paths['api']
+    json_tn_export.cachedir = os.path.join(paths['cache'], 'json_tn_export')
+    json_tn_export.runExport(json_tn_export.getLangs(paths['pages']),
+                                                  getToday(), None, opts['jobs'])
+
+def runReveal(paths, opts):
+    import reveal_export
+    reveal_export.obs_web = paths['www']
+    reveal_export.unfoldingWorddir = paths['api']
+    template = [ reveal_export.readFile(os.path.join(toolsdir, 'js',
+                                                        'index.head.html')),
+                 reveal_export.readFile(os.path.join(toolsdir, 'js',
+                                                        'index.foot.html')) ]
+    for lang in opts['langs']:
+        langjson = reveal_export.loadJSON(os.path.join(paths['api'], lang,
+                                           'obs-{0}.json'.format(lang)), 'd')
+        reveal_export.buildReveal(os.path.join(paths['www'], lang), langjson,
+                                                                     template)
+
+def runFormats(paths, opts):
+    import export
+    export.api_abs = paths['api']
+    for lang in opts['langs']:
+        for fmt in ('html', 'md', 'plain'):
+            export.main(lang, os.path.join(paths['formats'], lang,
+                              'obs-{0}.{1}'.format(lang, fmt)), fmt, '360px')
+
+def publish(paths, langs):
+    '''
+    Copies the Door43 exports to where the unfoldingWord API would have
+    them, standing in for the Github publishing step.
+    '''
+    for lang in langs:
+        src = os.path.join(paths['exports'], lang, 'obs',
+                                                  'obs-{0}.json'.format(lang))
+        makeDir(os.path.join(paths['api'], lang))
+        shutil.copy(src, os.path.join(paths['api'], lang,
+                                                 'obs-{0}.json'.format(lang)))
+
+def runStage(func, args):
+    '''
+    Runs func(*args) in a child process.  Returns the wall time, peak RSS
+    in MB and whether it succeeded.
+    '''
+    start = datetime.datetime.now()
+    pid = os.fork()
+    if pid == 0:
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        try:
+            func(*args)
+        except:
+            traceback.print_exc()
+            os._exit(1)
+        os._exit(0)
+    pid, status, rusage = os.wait4(pid, 0)
+    wall = datetime.datetime.now() - start
+    return ( wall.seconds + wall.microseconds / 1000000.0,
+             rusage.ru_maxrss / 1024.0,
+             status == 0 )
+
+def snapshot(d):
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(d):
+        for f in filenames:
+            path = os.path.join(dirpath, f)
+            st = os.stat(path)
+            files[path] = (st.st_mtime, st.st_size)
+    return files
+
+def countWritten(before, after):
+    return len([x for x in after if before.get(x) != after[x]])
+
+def getToday():
+    return ''.join(str(datetime.date.today()).rsplit('-')[0:3])
+
+def makeDir(d):
+    if not os.path.exists(d):
+        os.makedirs(d, 0755)
+
+def runBench(root, langcount, notescount, opts):
+    paths = getPaths(root)
+    results = []
+    start = datetime.datetime.now()
+    langs, written = make_corpus.makeCorpus(root, langcount, notescount)
+    wall = datetime.datetime.now() - start
+    results.append({ 'stage': 'corpus',
+                     'seconds': wall.seconds + wall.microseconds / 1000000.0,
+                     'rss_mb': None,
+                     'files': written,
+                     'ok': True,
+                   })
+    opts['langs'] = langs
+    opts['notes'] = langs[:notescount]
+    stages = [ ('json_export', runJSONExport),
+               ('json_export (warm)', runJSONExport),
+               ('publish', None),
+               ('json_tn_export', runTNExport),
+               ('reveal_export', runReveal),
+               ('export.py', runFormats),
+             ]
+    for name, func in stages:
+        before = snapshot(paths['out'])
+        if func is None:
+            publish(paths, langs)
+            results.append({ 'stage': name,
+                             'seconds': None,
+                             'rss_mb': None,
+                             'files': countWritten(before,
+                                                   snapshot(paths['out'])),
+                             'ok': True,
+                           })
+            continue
+        seconds, rss, ok = runStage(func, (paths, opts))
+        results.append({ 'stage': name,
+                         'seconds': seconds,
+                         'rss_mb': rss,
+                         'files': countWritten(before, snapshot(paths['out'])),
+                         'ok': ok,
+                       })
+    return results
+
+def printResults(results):
+    print '{0:20} {1:>10} {2:>10} {3:>8}'.format('stage', 'seconds',
+                                                       'peak MB', 'files')
+    for r in results:
+        seconds = rss = '-'
+        if r['seconds'] is not None:
+            seconds = '{0:.3f}'.format(r['seconds'])
+        if r['rss_mb'] is not None:
+            rss = '{0:.1f}'.format(r['rss_mb'])
+        flag = ''
+        if not r['ok']:
+            flag = '  FAILED'
+        print '{0:20} {1:>10} {2:>10} {3:>8}{4}'.format(r['stage'], seconds,
+                                                       rss, r['files'], flag)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-l', '--languages', dest="langs", type=int,
+        default=10, help="Number of languages")
+    parser.add_argument('-n', '--notes', dest="notes", type=int, default=1,
+        help="Number of languages with translationNotes and key terms")
+    parser.add_argument('-j', '--jobs', dest="jobs", type=int, default=1,
+        help="Worker processes for json_export")
+    parser.add_argument('--extras', dest="extras", action='store_true',
+        default=False, help="Have json_export write shards, deltas and "
+                            "minified files too")
+    parser.add_argument('-d', '--dir', dest="root", default=None,
+        help="Directory to work in (default: a new temporary directory)")
+    parser.add_argument('-k', '--keep', dest="keep", action='store_true',
+        default=False, help="Keep the working directory")
+    parser.add_argument('--json', dest="jsonout", default=None,
+        help="Also write the results as JSON to this file")
+    args = parser.parse_args(sys.argv[1:])
+    root = args.root
+    if root is None:
+        root = tempfile.mkdtemp(prefix='obs-bench-')
+    opts = { 'jobs': args.jobs,
+             'uwexport': False,
+             'full': False,
+             'shards': args.extras,
+             'deltas': args.extras,
+             'minify': args.extras,
+             'brotli': False,
+           }
+    try:
+        results = runBench(root, args.langs, args.notes, opts)
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+    printResults(results)
+    if args.jsonout:
+        json.dump(results, open(args.jsonout, 'w'), sort_keys=True, indent=2)
+    if not all([x['ok'] for x in results]):
+        sys.exit(1)
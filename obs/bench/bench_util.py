@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#  Copyright (c) 2014 unfoldingWord
+#  http://creativecommons.org/licenses/MIT/
+#  See LICENSE file for details.
+#
+#  Contributors:
+#  Jesse Griffin <jesse@distantshores.org>
+#
+
+'''
+Checking and timing helpers shared by chapter_bench.py and html_bench.py,
+which compare a json/ function against the code it replaced.
+'''
+
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                   '../json'))
+
+
+def check(old, new, corpus, item):
+    '''
+    Returns True if old and new give the same result for every entry of
+    corpus, otherwise prints the first entry (an item) that differs.
+    '''
+    for i, x in enumerate(corpus):
+        if old(x) != new(x):
+            print 'Mismatch in {0} {1}'.format(item, i + 1)
+            return False
+    return True
+
+def bench(funcs, corpus, number, rounds=5, setup=None):
+    '''
+    Returns the best time per pass over corpus for each of funcs.  The funcs
+    are timed in turn each round so that noise hits them all alike.  setup,
+    if given, is called before every pass.
+    '''
+    def runPass(func):
+        if setup:
+            setup()
+        return [func(x) for x in corpus]
+    best = [None] * len(funcs)
+    for r in range(rounds):
+        for i, func in enumerate(funcs):
+            timer = timeit.Timer(lambda: runPass(func))
+            t = min(timer.repeat(3, number)) / number
+            if best[i] is None or t < best[i]:
+                best[i] = t
+    return best
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#  Copyright (c) 2014 unfoldingWord
+#  http://creativecommons.org/licenses/MIT/
+#  See LICENSE file for details.
+#
+#  Contributors:
+#  Jesse Griffin <jesse@distantshores.org>
+#
+
+'''
+Checks json_export's splitChapter against the regex cascade it replaced, on
+a synthetic 50 chapter corpus: both must produce the same chapters and
+warnings.  They are then timed, to catch splitChapter getting slower; they
+are about as fast as each other, as most of the time goes on building each
+frame rather than on finding it.
+'''
+
+import re
+import sys
+import random
+import argparse
+# bench_util also puts ../json on sys.path
+from bench_util import check, bench
+import json_export
+
+
+# The regexes and functions json_export used before splitChapter
+titlere = re.compile(ur'======.*', re.UNICODE)
+refre = re.compile(ur'//.*//', re.UNICODE)
+framere = re.compile(ur'{{[^{]*', re.DOTALL | re.UNICODE)
+fridre = re.compile(ur'[0-5][0-9]-[0-9][0-9]', re.UNICODE)
+htmltagre = re.compile(ur'<.*>', re.UNICODE)
+linktagre = re.compile(ur'\[\[.*\]\]', re.UNICODE)
+imgtagre = re.compile(ur'{{.*}}', re.UNICODE)
+imglinkre = re.compile(ur'https://.*\.(jpg|jpeg|gif)', re.UNICODE)
+words = [ u'God', u'made', u'the', u'world', u'**light**', u'água', u'día',
+          u'__people__', u'and', u'said', u'\\\\', u'ведь', u'שלום' ]
+pollution = [ u'<b>', u'</b>', u'[[en:obs|link]]', u'{{x}}', u'//', u'{' ]
+
+
+def regexChapter(chapter, lang):
+    warnings = []
+    jsonchapter = { 'frames': [] }
+    title = titlere.search(chapter)
+    if title:
+        jsonchapter['title'] = title.group(0).replace('=', '').strip()
+    else:
+        jsonchapter['title'] = u'NOT FOUND'
+        warnings.append({ 'type': 'title', 'frame': None })
+    ref = refre.search(chapter)
+    if ref:
+        jsonchapter['ref'] = ref.group(0).replace('/', '').strip()
+    else:
+        jsonchapter['ref'] = u'NOT FOUND'
+        warnings.append({ 'type': 'ref', 'frame': None })
+    for fr in framere.findall(chapter):
+        frlines = fr.split('\n')
+        frse = fridre.search(fr)
+        if frse:
+            frid = frse.group(0)
+        else:
+            frid = u'NOT FOUND'
+            warnings.append({ 'type': 'frame_id', 'frame': frid })
+        frame = { 'id': frid,
+                  'img': regexImg(frlines[0].strip(), lang, frid),
+                  'text': regexText(frlines[1:], lang, frid, warnings)
+                }
+        jsonchapter['frames'].append(frame)
+    jsonchapter['frames'].sort(key=lambda frame: frame['id'])
+    return jsonchapter, warnings
+
+def regexImg(link, lang, frid):
+    linkse = imglinkre.search(link)
+    if linkse:
+        link = linkse.group(0)
+        return link
+    return json_export.imgurl.format('en', frid)
+
+def regexText(lines, lang, frid, warnings):
+    text = u''.join([x for x in lines[1:] if u'//' not in x]).strip()
+    text = text.replace(u'\\\\', u'').replace(u'**', u'').replace(u'__', u'')
+    if htmltagre.search(text):
+        text = htmltagre.sub(u'', text)
+        warnings.append({ 'type': 'html', 'frame': frid })
+    if linktagre.search(text):
+        text = linktagre.sub(u'', text)
+        warnings.append({ 'type': 'link', 'frame': frid })
+    if imgtagre.search(text):
+        text = imgtagre.sub(u'', text)
+        warnings.append({ 'type': 'img', 'frame': frid })
+    return text
+
+def splitChapter(chapter, lang):
+    parts = json_export.splitChapter(chapter)
+    jsonchapter = { 'frames': parts['frames'],
+                    'title': parts['title'],
+                    'ref': parts['ref'],
+                  }
+    jsonchapter['frames'].sort(key=lambda frame: frame['id'])
+    return jsonchapter, parts['warnings']
+
+def getCorpus(polluted):
+    '''
+    Returns 50 synthetic chapter pages laid out like the Door43 OBS pages.
+    If polluted is set, some frames get stray markup and some chapters lose
+    their title or reference.
+    '''
+    rnd = random.Random(50)
+    frames = {}
+    for frid in sorted(json_export.obsframeset):
+        frames.setdefault(frid[:2], []).append(frid)
+    corpus = []
+    for chp in sorted(frames):
+        page = []
+        if not polluted or rnd.random() > 0.1:
+            page.append(u'====== {0}. Story {0} ======\n\n'.format(chp))
+        for frid in frames[chp]:
+            page.append(u'{{{{https://api.unfoldingword.org/obs/jpg/1/en/'
+                      u'360px/obs-en-{0}.jpg?direct&}}}}\n\n'.format(frid))
+            text = [rnd.choice(words) for x in range(rnd.randint(20, 60))]
+            if polluted and rnd.random() < 0.2:
+                text.insert(rnd.randint(0, len(text)), rnd.choice(pollution))
+            page.append(u' '.join(text))
+            page.append(u'\n\n')
+        if not polluted or rnd.random() > 0.1:
+            page.append(u'//A Bible story from: Genesis {0}//\n'.format(chp))
+        corpus.append(u''.join(page))
+    return corpus
+
+def regexEN(chapter):
+    return regexChapter(chapter, 'en')
+
+def splitEN(chapter):
+    return splitChapter(chapter, 'en')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--number', dest="number", type=int, default=5,
+        help="Passes over the corpus per timing")
+    args = parser.parse_args(sys.argv[1:])
+    for name, polluted in (('clean', False), ('polluted', True)):
+        corpus = getCorpus(polluted)
+        if not check(regexEN, splitEN, corpus, 'chapter'):
+            sys.exit(1)
+        regext, splitt = bench([regexEN, splitEN], corpus, args.number)
+        print '{0:9} regex {1:8.2f} ms  split {2:8.2f} ms  ({3:.1f}x)'.format(
+                   name, regext * 1000, splitt * 1000, regext / splitt)
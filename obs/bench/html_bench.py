@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#  Copyright (c) 2014 unfoldingWord
+#  http://creativecommons.org/licenses/MIT/
+#  See LICENSE file for details.
+#
+#  Contributors:
+#  Jesse Griffin <jesse@distantshores.org>
+#
+
+'''
+Benchmarks json_tn_export's DokuWiki to HTML renderer against the regex
+cascade it replaced, on synthetic tN notes and key term definitions.  Both
+are checked to produce the same HTML before they are timed.
+'''
+
+import re
+import sys
+import random
+import argparse
+# bench_util also puts ../json on sys.path
+from bench_util import check, bench
+import json_tn_export
+
+
+# The regexes and functions json_tn_export used before renderHTML
+boldstartre = re.compile(ur'([ ,.])(\*\*)', re.UNICODE)
+boldstartre2 = re.compile(ur'\*\*', re.UNICODE)
+boldstopre = re.compile(ur'''(\*\*)([ ,.'!])''', re.UNICODE)
+lire = re.compile(ur' +\* ', re.UNICODE)
+h3re = re.compile(ur'\n=== (.*?) ===\n', re.UNICODE)
+words = [ u'God', u'made', u'the', u'world', u'**light**', u'água', u'día',
+          u'**people**', u'and', u'said', u'ведь', u'שלום', u'"**a', u'b**,' ]
+
+
+def regexHTML(text):
+    text = boldstartre.sub(ur'\1<b>', text)
+    text = boldstopre.sub(ur'</b>\2', text)
+    text = boldstartre2.sub(ur'<b>', text)
+    text = h3re.sub(ur'<h3>\1</h3>', text)
+    text = regexHTMLList(text)
+    return text.strip()
+
+def regexHTMLList(text):
+    started = False
+    newtext = []
+    for line in text.split(u'\n'):
+        if lire.search(line):
+            if not started:
+                started = True
+                newtext.append(u'<ul>')
+            line = lire.sub(u'<li>', line)
+            newtext.append(u'{0}</li>'.format(line))
+        else:
+            if started:
+                started = False
+                newtext.append(u'</ul>')
+            newtext.append(line)
+    if started:
+        newtext.append(u'</ul>')
+    return u''.join(newtext)
+
+def memoHTML(text):
+    return json_tn_export.getHTML(text)
+
+def getSentence(rnd, low, high):
+    return u' '.join([rnd.choice(words) for x in range(rnd.randint(low,
+                                                                   high))])
+
+def getCorpus(repeats):
+    '''
+    Returns the fragments getHTML sees for one language: a note per frame
+    item, a definition and examples per key term.  A repeats share of the
+    notes are copies of earlier ones.
+    '''
+    rnd = random.Random(15)
+    corpus = []
+    notes = []
+    for i in range(4000):
+        if notes and rnd.random() < repeats:
+            corpus.append(rnd.choice(notes))
+            continue
+        note = getSentence(rnd, 5, 30)
+        notes.append(note)
+        corpus.append(note)
+    for i in range(300):
+        items = [u'  * {0}'.format(getSentence(rnd, 4, 12))
+                                           for x in range(rnd.randint(0, 5))]
+        corpus.append(u'\n\n{0}\n\n=== Translation Suggestions ===\n{1}\n\n'
+                      u'{2}\n'.format(getSentence(rnd, 15, 40),
+                      u'\n'.join(items), getSentence(rnd, 5, 10)))
+        corpus.extend([getSentence(rnd, 8, 20) for x in range(4)])
+    return corpus
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--number', dest="number", type=int, default=5,
+        help="Passes over the corpus per timing")
+    args = parser.parse_args(sys.argv[1:])
+    for repeats in (0.0, 0.3):
+        corpus = getCorpus(repeats)
+        if not check(regexHTML, json_tn_export.renderHTML, corpus,
+                                                                 'fragment'):
+            sys.exit(1)
+        # The memo is emptied before every pass
+        regext, rendert, memot = bench([regexHTML,
+                json_tn_export.renderHTML, memoHTML], corpus, args.number,
+                setup=json_tn_export.htmlcache.clear)
+        print ('{0:3.0%} repeats  regex {1:7.2f} ms  single pass {2:7.2f} ms '
+               '({3:.1f}x)  memoized {4:7.2f} ms ({5:.1f}x)').format(repeats,
+                       regext * 1000, rendert * 1000, regext / rendert,
+                       memot * 1000, regext / memot)
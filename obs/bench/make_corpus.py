@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#  Copyright (c) 2014 unfoldingWord
+#  http://creativecommons.org/licenses/MIT/
+#  See LICENSE file for details.
+#
+#  Contributors:
+#  Jesse Griffin <jesse@distantshores.org>
+#
+
+'''
+Generates a synthetic Door43 data tree for benchmarking the OBS exporters.
+
+The tree is laid out like the live wiki:
+
+    <root>/gitrepo/pages/<lang>/obs/[0-5][0-9].txt and app_words.txt
+    <root>/gitrepo/pages/<lang>/obs/notes/frames/<frame>.txt
+    <root>/gitrepo/pages/<lang>/obs/notes/key-terms/<term>.txt
+    <root>/gitrepo/pages/en/uwadmin/<lang>/obs/status.txt
+    <root>/langnames.txt
+
+The content is random but deterministic for a given seed.
+'''
+
+import os
+import sys
+import codecs
+import random
+import argparse
+
+toolsdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(toolsdir), 'general_tools'))
+sys.path.append(os.path.join(toolsdir, 'json'))
+from json_export import obsframeset
+
+
+words = [ u'God', u'made', u'the', u'world', u'light', u'água', u'día',
+          u'people', u'and', u'said', u'ведь', u'שלום', u'garden', u'river',
+          u'Abraham', u'promise', u'son', u'covenant', u'good', u'evening' ]
+terms = [ u'god', u'create', u'adam', u'eve', u'sin', u'covenant',
+          u'promise', u'abraham', u'sacrifice', u'faith', u'prophet', u'king',
+          u'temple', u'law', u'grace', u'heaven', u'angel', u'priest',
+          u'israel', u'jesus' ]
+chaptertmpl = u'''====== {0}. {1} ======
+
+{2}//{3}//
+'''
+frametmpl = u'''{{{{https://api.unfoldingword.org/obs/jpg/1/en/360px/obs-en-{0}.jpg?direct&}}}}
+
+{1}
+
+'''
+statustmpl = u'''publish date: 2014-{0:02}-01
+version: 3
+contributors: Synthetic Translator
+checking entity: Synthetic Church
+checking level: {1}
+source text: en
+source text version: 3
+comments: Generated for benchmarking
+'''
+appwords = u'''next_chapter: Next Story
+cancel: Cancel
+chapters: Stories
+languages: Languages
+'''
+notetmpl = u'''====== {0} ======
+
+{{{{https://api.unfoldingword.org/obs/jpg/1/en/360px/obs-en-{0}.jpg?direct&}}}}
+
+==== Important Terms: ====
+
+{1}
+
+==== Translation Notes: ====
+
+{2}
+'''
+kttmpl = u'''====== {0} ======
+
+==== {1} ====
+
+===== Definition: =====
+
+{2}
+
+  * {3}
+  * {4}
+
+[See also: {5}]
+
+===== Examples from the Bible stories: =====
+
+{6}
+'''
+
+
+def getLangs(count):
+    '''
+    Returns count language codes, starting with en.
+    '''
+    langs = [u'en']
+    i = 0
+    while len(langs) < count:
+        langs.append(u'x{0:03}'.format(i))
+        i += 1
+    return langs
+
+def getSentence(rnd, low, high):
+    return u' '.join([rnd.choice(words) for x in range(rnd.randint(low,
+                                                                   high))])
+
+def getFrameIDs():
+    chapters = {}
+    for frid in sorted(obsframeset):
+        chapters.setdefault(frid[:2], []).append(frid)
+    return chapters
+
+def makeCorpus(root, langcount, notescount, seed=43):
+    '''
+    Writes the synthetic tree under root.  The first notescount languages
+    also get translationNotes frames and key terms.  Returns the list of
+    language codes and the number of files written.
+    '''
+    rnd = random.Random(seed)
+    pages = os.path.join(root, 'gitrepo', 'pages')
+    langs = getLangs(langcount)
+    chapters = getFrameIDs()
+    written = 0
+    for n, lang in enumerate(langs):
+        obsdir = os.path.join(pages, lang, 'obs')
+        for chp, frids in sorted(chapters.iteritems()):
+            frames = [frametmpl.format(x, getSentence(rnd, 20, 70))
+                                                               for x in frids]
+            writeFile(os.path.join(obsdir, '{0}.txt'.format(chp)),
+                      chaptertmpl.format(int(chp), getSentence(rnd, 2, 4),
+                      u''.join(frames), getSentence(rnd, 3, 5)))
+            written += 1
+        writeFile(os.path.join(obsdir, 'app_words.txt'), appwords)
+        writeFile(os.path.join(pages, 'en', 'uwadmin', lang, 'obs',
+                  'status.txt'), statustmpl.format(n % 12 + 1, n % 3 + 1))
+        written += 2
+        if n < notescount:
+            written += makeNotes(rnd, obsdir, chapters)
+    writeFile(os.path.join(root, 'langnames.txt'), u'# Synthetic\n' +
+              u''.join([u'{0}\tLanguage {0}\n'.format(x) for x in langs]))
+    return langs, written + 1
+
+def makeNotes(rnd, obsdir, chapters):
+    written = 0
+    framesdir = os.path.join(obsdir, 'notes', 'frames')
+    for frids in chapters.itervalues():
+        for frid in frids:
+            its = [u'  * [[en:obs:notes:key-terms:{0}|{1}]]'.format(x,
+                    x.capitalize()) for x in rnd.sample(terms, 3)]
+            notes = [u'  * **{0}** - {1} **{2}** {3}.'.format(
+                       getSentence(rnd, 1, 3), getSentence(rnd, 5, 15),
+                       rnd.choice(words), getSentence(rnd, 3, 10))
+                                               for x in range(rnd.randint(1, 5))]
+            writeFile(os.path.join(framesdir, '{0}.txt'.format(frid)),
+                      notetmpl.format(frid, u'\n'.join(its), u'\n'.join(notes)))
+            written += 1
+    ktdir = os.path.join(obsdir, 'notes', 'key-terms')
+    allframes = sorted(obsframeset)
+    for term in terms:
+        cf = u', '.join([u'[[en:obs:notes:key-terms:{0}|{1}]]'.format(x,
+                   x.capitalize()) for x in rnd.sample(terms, 2)])
+        examples = [u'***[[en:obs:notes:frames:{0}|[{0}]]]** {1}'.format(x,
+                    getSentence(rnd, 8, 20)) for x in sorted(rnd.sample(
+                                                               allframes, 4))]
+        writeFile(os.path.join(ktdir, '{0}.txt'.format(term)),
+                  kttmpl.format(term.capitalize(), getSentence(rnd, 1, 3),
+                  getSentence(rnd, 15, 40), getSentence(rnd, 5, 10),
+                  getSentence(rnd, 5, 10), cf, u'\n'.join(examples)))
+        written += 1
+    writeFile(os.path.join(ktdir, 'home.txt'), u'====== Key Terms ======\n')
+    return written + 1
+
+def writeFile(outfile, p):
+    makeDir(outfile.rpartition('/')[0])
+    f = codecs.open(outfile, 'w', encoding='utf-8')
+    f.write(p)
+    f.close()
+
+def makeDir(d):
+    if not os.path.exists(d):
+        os.makedirs(d, 0755)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-o', '--output', dest="root", required=True,
+        help="Root directory to write the tree to")
+    parser.add_argument('-l', '--languages', dest="langs", type=int,
+        default=10, help="Number of languages")
+    parser.add_argument('-n', '--notes', dest="notes", type=int, default=1,
+        help="Number of languages with translationNotes and key terms")
+    parser.add_argument('-s', '--seed', dest="seed", type=int, default=43,
+        help="Random seed")
+    args = parser.parse_args(sys.argv[1:])
+    langs, written = makeCorpus(args.root, args.langs, args.notes, args.seed)
+    print 'Wrote {0} files for {1} languages to {2}'.format(written,
+                                                        len(langs), args.root)
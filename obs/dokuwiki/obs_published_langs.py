@@ -14,8 +14,19 @@ import sys
 import json
 import codecs
 import urllib2
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                '../json'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                       '../../general_tools'))
+import catalog_store
+try:
+    import instrument
+except ImportError:
+    print "Please verify that general_tools/instrument.py exists."
+    sys.exit(1)
 
 caturl = 'http://api.unfoldingword.org/obs/txt/1/obs-catalog.json'
+catpath = '/var/www/vhosts/api.unfoldingword.org/httpdocs/obs/txt/1/obs-catalog.json'
 uwstatpage = '/var/www/vhosts/door43.org/httpdocs/data/gitrepo/pages/en/uwadmin/pub_status.txt'
 iconsdir = '/var/www/vhosts/api.unfoldingword.org/httpdocs/obs/jpg/1/checkinglevels'
 pub_statustmpl = u'''====== unfoldingWord OBS Published Languages ======
@@ -28,10 +39,15 @@ langtmpl = u'''
 
 def getCat(url):
     '''
-    Get's latest catalog from server.
+    Get's latest catalog from server, or through catalog_store if url is a
+    local catalog file.
     '''
+    if os.path.isfile(url):
+        return catalog_store.getEntries(catalog_store.loadCatalog(url))
+    instrument.count('http_calls')
     try:
-        request = urllib2.urlopen(url).read()
+        with instrument.span('http'):
+            request = urllib2.urlopen(url).read()
     except:
         print "  => ERROR retrieving %s\nCheck the URL" % url
         sys.exit(1)
@@ -61,4 +77,7 @@ def updatePage(caturl, uwstatpage):
     uwstatfd.close()
 
 if __name__ == '__main__':
-    updatePage(caturl, uwstatpage)
+    if os.path.isfile(catpath):
+        updatePage(catpath, uwstatpage)
+    else:
+        updatePage(caturl, uwstatpage)
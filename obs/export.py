@@ -20,6 +20,13 @@ import codecs
 import shutil
 import urllib2
 import argparse
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                          '../general_tools'))
+try:
+    import instrument
+except ImportError:
+    print "Please verify that general_tools/instrument.py exists."
+    sys.exit(1)
 
 api_url_txt = u'https://api.unfoldingword.org/obs/txt/1'
 api_url_jpg = u'https://api.unfoldingword.org/obs/jpg/1'
@@ -31,19 +38,23 @@ def writeFile(outfile, p):
     f = codecs.open(outfile, 'w', encoding='utf-8')
     f.write(p)
     f.close()
+    instrument.count('files_written')
+    instrument.countBytes('bytes_written', p)
 
 def makeDir(d):
     if not os.path.exists(d):
         os.makedirs(d, 0755)
 
 def getURL(url, outfile):
-    try:
-        request = urllib2.urlopen(url)
-    except:
-        print '  => ERROR retrieving {0}\nCheck the URL'.format(url)
-        return
-    with open(outfile, 'wb') as fp:
-        shutil.copyfileobj(request, fp)
+    instrument.count('http_calls')
+    with instrument.span('http'):
+        try:
+            request = urllib2.urlopen(url)
+        except:
+            print '  => ERROR retrieving {0}\nCheck the URL'.format(url)
+            return
+        with open(outfile, 'wb') as fp:
+            shutil.copyfileobj(request, fp)
 
 def loadJSON(f, t):
     if os.path.isfile(f):
@@ -151,6 +162,14 @@ if __name__ == '__main__':
         required=True, help="Desired format: html, md, tex, or plain")
     parser.add_argument('-r', '--resolution', dest="img_res", default='360px',
         help="Image resolution: 360px, or 2160px")
+    parser.add_argument('--metrics', dest="metrics", default=None,
+        help="Write timings and counters to this file (.prom for the "
+             "Prometheus textfile format, JSON otherwise)")
 
     args = parser.parse_args(sys.argv[1:])
-    main(args.lang, args.outpath, args.format, args.img_res)
+    if args.metrics:
+        instrument.enable('export')
+    with instrument.span('total', args.lang):
+        main(args.lang, args.outpath, args.format, args.img_res)
+    if args.metrics:
+        instrument.writeSummary(args.metrics)
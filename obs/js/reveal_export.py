@@ -18,10 +18,14 @@ import sys
 import json
 import codecs
 import shlex
+import argparse
 import datetime
 from subprocess import *
 sys.path.append('/var/www/vhosts/door43.org/tools/general_tools')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                       '../../general_tools'))
 try:
+    import instrument
     from git_wrapper import *
 except:
     print "Please verify that"
@@ -134,7 +138,8 @@ def rsync(src, dst):
     runCommand is defined in git_wrapper.
     '''
     okrets = [0, 23, 24]
-    c, ret = runCommand('rsync -havP {0} {1}'.format(src, dst))
+    with instrument.span('rsync'):
+        c, ret = runCommand('rsync -havP {0} {1}'.format(src, dst))
     if ret in okrets:
         return True
     return False
@@ -144,6 +149,7 @@ def getImgURL(lang, res, fid):
 
 def readFile(infile):
     f = codecs.open(infile, 'r', encoding='utf-8').read()
+    instrument.count('files_read')
     return f
 
 def writeFile(outfile, page):
@@ -151,6 +157,8 @@ def writeFile(outfile, page):
     f = codecs.open(outfile, 'w', encoding='utf-8')
     f.write(page)
     f.close()
+    instrument.count('files_written')
+    instrument.countBytes('bytes_written', page)
 
 def makeDir(d):
     if not os.path.exists(d):
@@ -158,6 +166,7 @@ def makeDir(d):
 
 def loadJSON(f, t):
     if os.path.isfile(f):
+        instrument.count('files_read')
         return json.load(codecs.open(f, 'r', encoding='utf-8'))
     if t == 'd':
       return json.loads('{}')
@@ -173,10 +182,23 @@ def export():
                                            'obs-{0}.json'.format( lang)), 'd')
         rjs_dir = os.path.join(obs_web, lang)
         template = [readFile(index_head), readFile(index_foot)]
-        buildReveal(rjs_dir, langjson, template)
+        with instrument.span('build', lang):
+            buildReveal(rjs_dir, langjson, template)
         unfoldingWordlangdir = os.path.join(unfoldingWorddir, lang)
-        github_export(rjs_dir, unfoldingWordlangdir, lang)
+        with instrument.span('publish', lang):
+            github_export(rjs_dir, unfoldingWordlangdir, lang)
 
 
 if __name__ == '__main__':
-    export()
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--metrics', dest="metrics", default=None,
+        help="Write timings and counters to this file (.prom for the "
+             "Prometheus textfile format, JSON otherwise)")
+    args = parser.parse_args(sys.argv[1:])
+    if args.metrics:
+        instrument.enable('reveal_export')
+    with instrument.span('total'):
+        export()
+    if args.metrics:
+        instrument.writeSummary(args.metrics)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#  Copyright (c) 2014 unfoldingWord
+#  http://creativecommons.org/licenses/MIT/
+#  See LICENSE file for details.
+#
+#  Contributors:
+#  Jesse Griffin <jesse@distantshores.org>
+#
+#  Requires the brotli module for .br files.
+
+'''
+Writes the minified and precompressed variants of an exported JSON file.
+
+For an export like obs-en.json this writes obs-en.min.json, plus .gz (and
+optionally .br) copies of both files, so the web server can hand out the
+compressed bytes as they are (e.g. nginx gzip_static).  The digest of the
+content they were built from is kept in obs-en.min.json.sha1, and nothing is
+rebuilt until the caller passes a different digest.
+
+The export is read from disk a block or a line at a time and every variant
+is written as it goes, so the document is never held in memory.  Minifying
+only drops the whitespace outside strings, which for a file written with
+sort_keys gives the same bytes as json.dumps(j, sort_keys=True,
+separators=(',', ':')).
+'''
+
+import os
+import re
+import gzip
+from fileutil import getTmpPath, writeFileAtomic, makeDir
+
+# Patterns for a .gitignore, so the artifacts stay out of the Github repos
+gitignore = u'''*.min.json
+*.min.json.sha1
+*.gz
+*.br
+'''
+blocksize = 65536
+# A JSON string, or a run of anything else but whitespace
+tokenre = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[^"\s]+')
+
+
+def getMinPath(outfile):
+    return '{0}.min.json'.format(outfile.rpartition('.json')[0])
+
+def getArtifactPaths(outfile, usebrotli):
+    minfile = getMinPath(outfile)
+    exts = ['.gz']
+    if usebrotli:
+        exts.append('.br')
+    paths = [minfile]
+    for f in (outfile, minfile):
+        paths.extend(['{0}{1}'.format(f, x) for x in exts])
+    return paths
+
+def writeArtifacts(outfile, digest, usebrotli=False):
+    '''
+    Rebuilds the artifacts for outfile from the file on disk, unless they
+    were already built from content with the given digest.  Returns True if
+    anything was written.
+    '''
+    digestfile = '{0}.sha1'.format(getMinPath(outfile))
+    if ( os.path.isfile(digestfile) and
+           open(digestfile, 'r').read().strip() == digest and
+           all([os.path.isfile(x) for x in
+                                    getArtifactPaths(outfile, usebrotli)]) ):
+        return False
+    f = open(outfile, 'rb')
+    try:
+        writeVariants(outfile, iter(lambda: f.read(blocksize), ''),
+                                                        usebrotli, False)
+        f.seek(0)
+        writeVariants(getMinPath(outfile), iterMinified(f), usebrotli)
+    finally:
+        f.close()
+    writeFileAtomic(digestfile, digest)
+    return True
+
+def iterMinified(f):
+    '''
+    Yields the lines of the JSON file f without the whitespace outside its
+    strings.  JSON escapes the newlines in strings, so none spans two lines.
+    '''
+    for line in f:
+        yield ''.join(tokenre.findall(line))
+
+def writeVariants(outfile, pieces, usebrotli, plain=True):
+    '''
+    Writes pieces gzipped to outfile.gz, with brotli to outfile.br if
+    usebrotli is set and as they are to outfile if plain is set, a piece at
+    a time.  The gzip header has no file name or timestamp, so the same
+    content always gives the same bytes.  Each file is written to a
+    temporary file and renamed into place.
+    '''
+    paths = ['{0}.gz'.format(outfile)]
+    if usebrotli:
+        paths.append('{0}.br'.format(outfile))
+    if plain:
+        paths.append(outfile)
+    tmpfiles = dict([(x, getTmpPath(x)) for x in paths])
+    makeDir(os.path.dirname(os.path.abspath(outfile)))
+    files = dict([(x, open(tmpfiles[x], 'wb')) for x in paths])
+    try:
+        gz = gzip.GzipFile(filename='', mode='wb', compresslevel=9,
+                                         fileobj=files[paths[0]], mtime=0)
+        br = None
+        if usebrotli:
+            import brotli
+            br = brotli.Compressor(mode=brotli.MODE_TEXT)
+        for piece in pieces:
+            gz.write(piece)
+            if br:
+                files[paths[1]].write(br.process(piece))
+            if plain:
+                files[outfile].write(piece)
+        gz.close()
+        if br:
+            files[paths[1]].write(br.finish())
+    except:
+        for x in paths:
+            files[x].close()
+            os.remove(tmpfiles[x])
+        raise
+    for x in paths:
+        files[x].close()
+        os.rename(tmpfiles[x], x)
+
+def hasBrotli():
+    try:
+        import brotli
+    except ImportError:
+        return False
+    return True
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#  Copyright (c) 2014 unfoldingWord
+#  http://creativecommons.org/licenses/MIT/
+#  See LICENSE file for details.
+#
+#  Contributors:
+#  Jesse Griffin <jesse@distantshores.org>
+#
+
+'''
+Keyed access to the OBS catalogs (a JSON list of language entries).
+
+A store is loaded once, updated in memory by language code and written back
+in one go with commitCatalog, which replaces the file atomically.  Entries
+keep their order in the file, except that replaceEntry moves the language to
+the end, as the unfoldingWord catalog has always done.
+'''
+
+import os
+import json
+from collections import OrderedDict
+from fileutil import getDump, writeFileAtomic
+
+
+def loadCatalog(path):
+    '''
+    Returns a store for the catalog at path, empty if it does not exist.
+    Only the first entry of a language listed more than once is kept, with a
+    warning, and the others are dropped the next time the catalog is
+    written.
+    '''
+    entries = OrderedDict()
+    if os.path.isfile(path):
+        for entry in json.load(open(path, 'r')):
+            if entry['language'] in entries:
+                print u'WARNING: duplicate entry for {0} in {1}'.format(
+                                                    entry['language'], path)
+                continue
+            entries[entry['language']] = entry
+    return { 'path': path,
+             'entries': entries,
+             'dirty': not os.path.isfile(path),
+           }
+
+def getEntries(store):
+    return store['entries'].values()
+
+def addEntry(store, entry):
+    '''
+    Adds entry unless its language is already in the catalog.
+    '''
+    if entry['language'] in store['entries']:
+        return False
+    store['entries'][entry['language']] = entry
+    store['dirty'] = True
+    return True
+
+def replaceEntry(store, entry):
+    '''
+    Replaces any existing entry for the language and moves it to the end.
+    '''
+    store['entries'].pop(entry['language'], None)
+    store['entries'][entry['language']] = entry
+    store['dirty'] = True
+
+def updateEntry(store, lang, values):
+    '''
+    Sets the given keys on the entry for lang.
+    '''
+    entry = store['entries'][lang]
+    for k, v in values.iteritems():
+        if entry.get(k) != v:
+            entry[k] = v
+            store['dirty'] = True
+
+def commitCatalog(store):
+    '''
+    Writes the catalog back to its path if anything changed.  The JSON is
+    written to a temporary file first and renamed over the old catalog.
+    '''
+    if not store['dirty']:
+        return False
+    writeFileAtomic(store['path'], getDump(getEntries(store)))
+    store['dirty'] = False
+    return True
@@ -9,14 +9,51 @@
 #  Jesse Griffin <jesse@distantshores.org>
 #
 
+'''
+Compares versions of Open Bible Stories and writes the changes as HTML.
+
+Each pair of the given OBS JSON files (versions of one language, or several
+languages) gets a <a>-to-<b>/ directory, <a> and <b> being the file names
+without obs- and .json.  In it index.html lists the stories with the number
+of frames changed in each, linked to a <story>.html page for every story
+with changes.  The story pages of all the pairs are written by -j worker
+processes.  matrix.html has the number of frames that changed between every
+pair.  Each file is read and split into words once.
+
+With --stats FILE no pages are written, only the numbers for each pair per
+story and in total: frames changed, added and removed, words added and
+removed and the edit ratio, the share of the words of both versions that
+were added or removed.  FILE is CSV if it ends in .csv and JSON otherwise.
+
+With --store DIR the versions are names in a version_store.py store (all of
+them if none are given).  Their manifests and the store's text index are
+read, but only the texts of the frames whose hashes differ.
+
+Frames are matched by id, so a frame added to or removed from a story only
+shows up as such.  Frames whose text has the same SHA-1 in both versions are
+not diffed at all, the rest go through diffTokens (Myers' O(ND) algorithm)
+and are shown inline with <del> and <ins>.
+'''
+
 import os
+import cgi
 import sys
 import json
+import csv
 import codecs
-import difflib
+import hashlib
+import argparse
+import multiprocessing
+import StringIO
+import version_store
+from collections import OrderedDict
+from fileutil import loadJSON, writeFileAtomic, makeDir
 
 
 no_change = u'<p>No change in frame {0}.</p>'
+statfields = ['frames', 'frames_changed', 'frames_added', 'frames_removed',
+              'words_old', 'words_new', 'words_added', 'words_removed',
+              'edit_ratio']
 htmlfoot = u'''
 </body>
 </html>'''
@@ -25,58 +62,482 @@ obsframeset = set([
 ])
 
 
-def runDiff(v_a, v_b, a_ver, b_ver):
+def loadVersion(path):
     '''
-    Runs frames through frameDiff.  Returns output.
+    Reads an OBS JSON file.  Returns its name, its story titles by story
+    number and the SHA-1, the words and the number of words of each frame's
+    text by frame id.
     '''
-    html = []
-    for v_a_chp, v_b_chp in zip(v_a, v_b):
-        html.append(u'<h2>Story {0}</h2>'.format(v_a_chp['title']))
-        for v_a_chp_fr, v_b_chp_fr in zip(v_a_chp['frames'], v_b_chp['frames']):
-            html.append(u'<h3>Frame {0}</h3>'.format(v_a_chp_fr['id']))
-            html.append(frameDiff(v_a_chp_fr, v_b_chp_fr, a_ver, b_ver))
-    return '\n'.join(html)
-
-def frameDiff(a, b, a_ver, b_ver):
-    '''
-    Returns diff from a given frame if necessary.
-    '''
-    do_diff = False
-    if a['text'] == b['text']:
-        return no_change.format(a['id'])
-    al = a['text'].split()
-    bl = b['text'].split()
-    return unicode(difflib.HtmlDiff().make_table(al, bl, a_ver, b_ver))
-
-def loadJSON(f, t):
-    if os.path.isfile(f):
-        return json.load(open(f, 'r'))
-    if t == 'd':
-      return json.loads('{}')
-    else:
-      return json.loads('[]')
+    jsonlang = loadJSON(path, 'd')
+    version = { 'name': getVersionName(path),
+                'titles': {},
+                'digests': {},
+                'tokens': {},
+                'words': {},
+              }
+    for c in jsonlang['chapters']:
+        for fr in c['frames']:
+            version['titles'].setdefault(getStory(fr['id']), c['title'])
+            version['digests'][fr['id']] = hashlib.sha1(
+                                         fr['text'].encode('utf-8')).hexdigest()
+            version['tokens'][fr['id']] = fr['text'].split()
+            version['words'][fr['id']] = len(version['tokens'][fr['id']])
+    return version
+
+def loadStoredVersion(storedir, name):
+    '''
+    Reads the manifest of version name from a version_store.py store.
+    Returns the same as loadVersion, except that the words of each frame
+    are only read from the store by getTokens when they are needed.
+    '''
+    version = { 'name': name,
+                'titles': {},
+                'digests': {},
+                'tokens': {},
+                'words': {},
+                'store': storedir,
+              }
+    for c in version_store.loadManifest(storedir, name)['chapters']:
+        for fr in c['frames']:
+            version['titles'].setdefault(getStory(fr['id']), c['title'])
+            version['digests'][fr['id']] = fr['hash']
+            version['words'][fr['id']] = fr['words']
+    return version
+
+def getTokens(version, frid):
+    '''
+    Returns the words of frame frid in version, or None if it has no such
+    frame.
+    '''
+    tokens = version['tokens']
+    if frid not in tokens and frid in version['digests']:
+        tokens[frid] = version_store.getText(version['store'],
+                                             version['digests'][frid]).split()
+    return tokens.get(frid)
+
+def getVersionName(path):
+    return version_store.getVersionName(path)
+
+def getStory(frid):
+    return frid.split('-')[0]
+
+def getFrameIDs(v_a, v_b):
+    return sorted(set(v_a['digests']) | set(v_b['digests']))
+
+def getStories(v_a, v_b):
+    '''
+    Returns an ordered dict of story number to the ids of its frames in
+    either version.
+    '''
+    stories = OrderedDict()
+    for frid in getFrameIDs(v_a, v_b):
+        stories.setdefault(getStory(frid), []).append(frid)
+    return stories
+
+def getStoryTitle(v_a, v_b, story):
+    return v_b['titles'].get(story, v_a['titles'].get(story))
+
+def getChanged(v_a, v_b, frids):
+    return [x for x in frids if v_a['digests'].get(x) !=
+                                                   v_b['digests'].get(x)]
+
+def getStoryVersion(version, story, frids):
+    '''
+    Returns the part of version needed to diff one story, which is all a
+    worker process is sent.
+    '''
+    part = dict(version)
+    part['titles'] = { story: version['titles'].get(story) }
+    for k in ('digests', 'tokens', 'words'):
+        part[k] = dict([(x, version[k][x]) for x in frids
+                                                       if x in version[k]])
+    return part
+
+def runDiff(v_a, v_b, story, frids):
+    '''
+    Runs the frames frids of a story through frameDiff, matched by id.
+    Returns the HTML.
+    '''
+    html = [u'<h2>Story {0}</h2>'.format(getStoryTitle(v_a, v_b, story))]
+    for frid in frids:
+        html.append(u'<h3>Frame {0}</h3>'.format(frid))
+        if v_a['digests'].get(frid) == v_b['digests'].get(frid):
+            html.append(no_change.format(frid))
+            continue
+        html.append(frameDiff(v_a, v_b, frid))
+    return u'\n'.join(html)
 
-def writeFile(outfile, p):
-    f = codecs.open(outfile, 'w', encoding='utf-8')
-    f.write(p)
-    f.close()
+def writeStoryPage(args):
+    '''
+    Writes the diff page of one story, e.g. in a pool worker.
+    '''
+    v_a, v_b, story, frids, head, outfile = args
+    title = u'OBS {0} to {1}'.format(v_a['name'], v_b['name'])
+    writeFileAtomic(outfile, u'\n'.join([head % (title, u'Open Bible Stories '
+              u'Changes - {0} to {1}'.format(v_a['name'], v_b['name'])),
+              u'<p><a href="index.html">All stories</a></p>',
+              runDiff(v_a, v_b, story, frids), htmlfoot]))
+    return outfile
+
+def frameDiff(v_a, v_b, frid):
+    '''
+    Returns the diff of frame frid between two versions.  A frame missing
+    from one of them diffs against no words.
+    '''
+    return renderDiff(diffTokens(getTokens(v_a, frid) or [],
+                                 getTokens(v_b, frid) or []),
+                      v_a['name'], v_b['name'])
+
+def runMatrix(versions, head, outdir, jobs=1):
+    '''
+    Writes the pages for each pair of versions, older (earlier in the list)
+    to newer, the story pages in jobs worker processes.  Returns a dict of
+    (i, j) to the number of frames that changed between versions[i] and
+    versions[j], for i < j.
+    '''
+    matrix = {}
+    pages = []
+    for i, v_a in enumerate(versions):
+        for j in range(i + 1, len(versions)):
+            v_b = versions[j]
+            pairdir = os.path.join(outdir, getPairDir(v_a, v_b))
+            makeDir(pairdir)
+            counts = OrderedDict()
+            storypages = set()
+            for story, frids in getStories(v_a, v_b).iteritems():
+                counts[story] = len(getChanged(v_a, v_b, frids))
+                if not counts[story]:
+                    continue
+                storypages.add(getStoryPage(story))
+                pages.append((getStoryVersion(v_a, story, frids),
+                              getStoryVersion(v_b, story, frids), story,
+                              frids, head,
+                              os.path.join(pairdir, getStoryPage(story))))
+            for name in os.listdir(pairdir):
+                if ( name.endswith('.html') and name not in storypages and
+                                                    name != 'index.html' ):
+                    os.remove(os.path.join(pairdir, name))
+            writeFileAtomic(os.path.join(pairdir, 'index.html'),
+                                       getIndexPage(v_a, v_b, counts, head))
+            matrix[(i, j)] = sum(counts.values())
+    mapPages(writeStoryPage, pages, jobs)
+    return matrix
+
+def mapPages(func, arglist, jobs):
+    '''
+    Runs func over arglist, in a pool of jobs worker processes if jobs is
+    more than one.
+    '''
+    if jobs < 2 or len(arglist) < 2:
+        return [func(x) for x in arglist]
+    pool = multiprocessing.Pool(min(jobs, len(arglist)))
+    try:
+        return pool.map(func, arglist, 1)
+    finally:
+        pool.close()
+        pool.join()
+
+def getIndexPage(v_a, v_b, counts, head):
+    '''
+    Returns the page listing the stories of a pair with the number of
+    frames changed in each, linked to their pages.
+    '''
+    title = u'OBS {0} to {1}'.format(v_a['name'], v_b['name'])
+    html = [head % (title, u'Open Bible Stories Changes - {0} to {1}'.format(
+                                                    v_a['name'], v_b['name'])),
+            u'<p>{0} frames changed in {1} of {2} stories.</p>'.format(
+               sum(counts.values()), len([x for x in counts.values() if x]),
+               len(counts)),
+            u'<table class="index">',
+            u'<tr><th>Story</th><th>Frames changed</th></tr>']
+    for story, count in counts.iteritems():
+        title = cgi.escape(getStoryTitle(v_a, v_b, story))
+        if count:
+            title = u'<a href="{0}">{1}</a>'.format(getStoryPage(story),
+                                                                       title)
+        html.append(u'<tr><td>{0}</td><td>{1}</td></tr>'.format(title, count))
+    html.extend([u'</table>', htmlfoot])
+    return u'\n'.join(html)
+
+def getPairDir(v_a, v_b):
+    return u'{0}-to-{1}'.format(v_a['name'], v_b['name'])
+
+def getPairPage(v_a, v_b):
+    return u'{0}/index.html'.format(getPairDir(v_a, v_b))
+
+def getStoryPage(story):
+    return u'{0}.html'.format(story)
+
+def getPairStats(v_a, v_b):
+    '''
+    Returns the change counts between two versions from loadVersion, per
+    story and in total, without rendering anything.
+    '''
+    stories = {}
+    total = newStats()
+    for frid in getFrameIDs(v_a, v_b):
+        stats = stories.setdefault(getStory(frid), newStats())
+        counts = { 'frames': 1,
+                   'words_old': v_a['words'].get(frid, 0),
+                   'words_new': v_b['words'].get(frid, 0),
+                   'words_added': 0,
+                   'words_removed': 0,
+                 }
+        if frid not in v_a['digests']:
+            counts['frames_added'] = 1
+        elif frid not in v_b['digests']:
+            counts['frames_removed'] = 1
+        if v_a['digests'].get(frid) != v_b['digests'].get(frid):
+            counts['frames_changed'] = 1
+            for op, tokens in diffTokens(getTokens(v_a, frid) or [],
+                                         getTokens(v_b, frid) or []):
+                if op == '+':
+                    counts['words_added'] += len(tokens)
+                elif op == '-':
+                    counts['words_removed'] += len(tokens)
+        for stat in (stats, total):
+            for k, n in counts.iteritems():
+                stat[k] += n
+    for stats in stories.values() + [total]:
+        words = stats['words_old'] + stats['words_new']
+        if words:
+            stats['edit_ratio'] = round(float(stats['words_added'] +
+                                          stats['words_removed']) / words, 4)
+    return { 'from': v_a['name'],
+             'to': v_b['name'],
+             'stories': stories,
+             'total': total,
+           }
+
+def newStats():
+    stats = dict([(x, 0) for x in statfields])
+    stats['edit_ratio'] = 0.0
+    return stats
+
+def writeStats(outfile, pairs):
+    '''
+    Writes the getPairStats results as CSV, a row per story and a total row
+    (story "all") per pair, if outfile ends in .csv, or as JSON otherwise.
+    '''
+    if not outfile.endswith('.csv'):
+        writeFileAtomic(outfile, json.dumps(pairs, indent=2, sort_keys=True))
+        return
+    f = StringIO.StringIO()
+    writer = csv.writer(f)
+    writer.writerow(['from', 'to', 'story'] + statfields)
+    for pair in pairs:
+        rows = sorted(pair['stories'].items()) + [('all', pair['total'])]
+        for story, stats in rows:
+            writer.writerow([x.encode('utf-8') for x in (pair['from'],
+                    pair['to'], story)] + [stats[x] for x in statfields])
+    writeFileAtomic(outfile, f.getvalue())
+
+def getMatrixHTML(versions, matrix):
+    '''
+    Returns a table of the changed frame counts, linked to the diff pages.
+    '''
+    html = [u'<table class="matrix">', u'<tr><th></th>']
+    html.extend([u'<th>{0}</th>'.format(cgi.escape(x['name']))
+                                                           for x in versions])
+    html.append(u'</tr>')
+    for i, v_a in enumerate(versions):
+        html.append(u'<tr><th>{0}</th>'.format(cgi.escape(v_a['name'])))
+        for j, v_b in enumerate(versions):
+            if i == j:
+                html.append(u'<td>-</td>')
+                continue
+            pair = (min(i, j), max(i, j))
+            html.append(u'<td><a href="{0}">{1}</a></td>'.format(
+                   getPairPage(versions[pair[0]], versions[pair[1]]),
+                   matrix[pair]))
+        html.append(u'</tr>')
+    html.append(u'</table>')
+    return u'\n'.join(html)
+
+def printMatrix(versions, matrix):
+    width = max([len(x['name']) for x in versions] + [6])
+    print u' '.join([u' ' * width] + [x['name'].rjust(width)
+                                                        for x in versions])
+    for i, v_a in enumerate(versions):
+        row = [v_a['name'].ljust(width)]
+        for j in range(len(versions)):
+            if i == j:
+                row.append(u'-'.rjust(width))
+            else:
+                row.append(unicode(matrix[(min(i, j), max(i, j))]
+                                                               ).rjust(width))
+        print u' '.join(row)
+
+def diffTokens(a, b):
+    '''
+    Returns the shortest edit script from token list a to b as a list of
+    (op, tokens), op being '=' for tokens in both, '-' for tokens only in a
+    and '+' for tokens only in b.  Where a run of tokens is replaced, the
+    '-' comes before the '+'.
+    '''
+    pre = 0
+    while pre < len(a) and pre < len(b) and a[pre] == b[pre]:
+        pre += 1
+    suf = 0
+    while ( suf < len(a) - pre and suf < len(b) - pre and
+                                                   a[-suf - 1] == b[-suf - 1] ):
+        suf += 1
+    edits = [('=', x) for x in a[:pre]]
+    edits.extend(myersDiff(a[pre:len(a) - suf], b[pre:len(b) - suf]))
+    edits.extend([('=', x) for x in a[len(a) - suf:]])
+    ops = []
+    dels = []
+    ins = []
+    for op, token in edits:
+        if op == '-':
+            dels.append(token)
+        elif op == '+':
+            ins.append(token)
+        else:
+            addChange(ops, dels, ins)
+            dels = []
+            ins = []
+            if ops and ops[-1][0] == '=':
+                ops[-1][1].append(token)
+            else:
+                ops.append(('=', [token]))
+    addChange(ops, dels, ins)
+    return ops
+
+def addChange(ops, dels, ins):
+    if dels:
+        ops.append(('-', dels))
+    if ins:
+        ops.append(('+', ins))
+
+def myersDiff(a, b):
+    '''
+    Returns the edits from a to b as (op, token) pairs, following the
+    furthest reaching path on each diagonal for D = 0, 1, 2... until one
+    reaches the end of both lists.  The path ends are kept per D to walk
+    back along.
+    '''
+    n = len(a)
+    m = len(b)
+    v = {1: 0}
+    trace = []
+    for d in range(n + m + 1):
+        trace.append(dict(v))
+        for k in range(-d, d + 1, 2):
+            if k == -d or ( k != d and v[k - 1] < v[k + 1] ):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                return getEdits(trace, a, b)
+    return []
+
+def getEdits(trace, a, b):
+    x = len(a)
+    y = len(b)
+    edits = []
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or ( k != d and v[k - 1] < v[k + 1] ):
+            prevk = k + 1
+        else:
+            prevk = k - 1
+        prevx = v[prevk]
+        prevy = prevx - prevk
+        while x > prevx and y > prevy:
+            edits.append(('=', a[x - 1]))
+            x -= 1
+            y -= 1
+        if d > 0:
+            if x == prevx:
+                edits.append(('+', b[y - 1]))
+            else:
+                edits.append(('-', a[x - 1]))
+        x = prevx
+        y = prevy
+    edits.reverse()
+    return edits
+
+def renderDiff(ops, a_ver, b_ver):
+    '''
+    Returns the ops from diffTokens as a paragraph of text with the removed
+    words in <del> and the added ones in <ins>.
+    '''
+    html = []
+    for op, tokens in ops:
+        text = cgi.escape(u' '.join(tokens))
+        if op == '-':
+            text = u'<del title="{0}">{1}</del>'.format(a_ver, text)
+        elif op == '+':
+            text = u'<ins title="{0}">{1}</ins>'.format(b_ver, text)
+        html.append(text)
+    return u'<p class="diff">{0}</p>'.format(u' '.join(html))
 
 
 if __name__ == '__main__':
-    v1jf = loadJSON('obs-ver_1.json', 'd')
-    v2jf = loadJSON('obs-ver_2.json', 'd')
-    v3jf = loadJSON('obs-ver_3.json', 'd')
-
-    head = codecs.open('compare.template.html', 'r', encoding='utf-8').read()
-
-    htmlhead = head % ('OBS v1 to v3',
-             'Open Bible Stories Changes - Version 1 to Version 3')
-    v1_v3 = runDiff(v1jf['chapters'], v3jf['chapters'], 'Version 1', 'Version 3')
-    v1_v3_page = '\n'.join([htmlhead, v1_v3, htmlfoot])
-    writeFile('ver_1-to-ver_3.html', v1_v3_page)
-
-    htmlhead = head % ('OBS v2 to v3',
-             'Open Bible Stories Changes - Version 2 to Version 3')
-    v2_v3 = runDiff(v2jf['chapters'], v3jf['chapters'], 'Version 2', 'Version 3')
-    v2_v3_page = '\n'.join([htmlhead, v2_v3, htmlfoot])
-    writeFile('ver_2-to-ver_3.html', v2_v3_page)
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('versions', nargs='*', help="OBS JSON files, "
+        "oldest first (default: obs-ver_1.json obs-ver_2.json "
+        "obs-ver_3.json), or version names with --store")
+    parser.add_argument('-o', '--output', dest="outdir", default='.',
+        help="Directory to write the pages to")
+    parser.add_argument('-t', '--template', dest="template",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'compare.template.html'),
+        help="HTML head for the pages")
+    parser.add_argument('--stats', dest="stats", default=None,
+        help="Only write the change statistics of each pair to this file "
+             "(.csv for CSV, JSON otherwise)")
+    parser.add_argument('--store', dest="store", default=None,
+        help="Compare versions from this version_store.py store")
+    parser.add_argument('-j', '--jobs', dest="jobs", type=int,
+        default=multiprocessing.cpu_count(),
+        help="Number of worker processes to write the story pages with "
+             "(default: one per CPU)")
+    args = parser.parse_args(sys.argv[1:])
+    if args.store:
+        names = args.versions or version_store.getVersionNames(args.store)
+    else:
+        paths = args.versions or ['obs-ver_1.json', 'obs-ver_2.json',
+                                  'obs-ver_3.json']
+        for path in paths:
+            if not os.path.isfile(path):
+                print 'Cannot find {0}'.format(path)
+                sys.exit(1)
+        names = [getVersionName(x) for x in paths]
+    if len(names) < 2:
+        print 'Need at least two versions to compare'
+        sys.exit(1)
+    if len(set(names)) < len(names):
+        print 'The versions need different names: {0}'.format(
+                                                            ', '.join(names))
+        sys.exit(1)
+
+    if args.store:
+        try:
+            versions = [loadStoredVersion(args.store, x) for x in names]
+        except ValueError as e:
+            print e
+            sys.exit(1)
+    else:
+        versions = [loadVersion(x) for x in paths]
+    if args.stats:
+        writeStats(args.stats, [getPairStats(versions[i], versions[j])
+                                for i in range(len(versions))
+                                for j in range(i + 1, len(versions))])
+        sys.exit(0)
+
+    head = codecs.open(args.template, 'r', encoding='utf-8').read()
+    makeDir(args.outdir)
+    matrix = runMatrix(versions, head, args.outdir, args.jobs)
+    writeFileAtomic(os.path.join(args.outdir, 'matrix.html'), u'\n'.join([
+              head % ('OBS changes', 'Open Bible Stories Changes - Frames '
+                      'Changed'), getMatrixHTML(versions, matrix), htmlfoot]))
+    printMatrix(versions, matrix)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#  Copyright (c) 2014 unfoldingWord
+#  http://creativecommons.org/licenses/MIT/
+#  See LICENSE file for details.
+#
+#  Contributors:
+#  Jesse Griffin <jesse@distantshores.org>
+#
+
+'''
+File helpers shared by the OBS JSON tools.
+
+Files are written to a temporary file next to the target (see getTmpPath)
+which is then renamed into place, so readers such as the web server or a
+concurrent export never see a partially written file.
+'''
+
+import os
+import json
+import codecs
+
+
+def getDump(j):
+    return json.dumps(j, sort_keys=True, indent=2)
+
+def loadJSON(f, t):
+    if os.path.isfile(f):
+        return json.load(codecs.open(f, 'r', encoding='utf-8'))
+    if t == 'd':
+      return json.loads('{}')
+    else:
+      return json.loads('[]')
+
+def getTmpPath(outfile):
+    return '{0}.{1}.tmp'.format(outfile, os.getpid())
+
+def writeFileAtomic(outfile, p):
+    '''
+    Writes p, text or bytes, to outfile.  Text is written as UTF-8.
+    '''
+    makeDir(os.path.dirname(os.path.abspath(outfile)))
+    if isinstance(p, unicode):
+        p = p.encode('utf-8')
+    tmpfile = getTmpPath(outfile)
+    f = open(tmpfile, 'wb')
+    f.write(p)
+    f.close()
+    os.rename(tmpfile, outfile)
+
+def makeDir(d):
+    if not os.path.exists(d):
+        os.makedirs(d, 0755)
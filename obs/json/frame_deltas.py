@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#  Copyright (c) 2014 unfoldingWord
+#  http://creativecommons.org/licenses/MIT/
+#  See LICENSE file for details.
+#
+#  Contributors:
+#  Jesse Griffin <jesse@distantshores.org>
+#
+
+'''
+Builds the frame level delta feed for an OBS language export.
+
+The digest of every frame in the last export is kept in a state file, along
+with those of the chapters without their frames (title, ref) and of the
+other fields of the export (app_words, direction).  When a new export is
+written, they are compared against it and a delta is added to the feed (e.g.
+obs-en.deltas.json):
+
+    { "from": "20141001", "to": "20141008",
+      "added": [ {frame} ], "changed": [ {frame} ], "removed": [ "07-03" ],
+      "chapters": [ {"number": "07", "title": ..., "ref": ...} ],
+      "fields": { "app_words": {...} } }
+
+"chapters" holds the new or changed chapters and "fields" the changed fields,
+both in full.  A client holding the export from "from" can apply the delta
+to get the one from "to" (a chapter left without frames has been removed).
+The feed keeps at most maxdeltas entries, older ones are merged together so
+that the oldest entry simply covers a longer range.
+'''
+
+import json
+import hashlib
+from fileutil import getDump, loadJSON, writeFileAtomic
+
+maxdeltas = 10
+
+
+def getDigest(j):
+    return hashlib.sha1(json.dumps(j, sort_keys=True,
+                                   separators=(',', ':'))).hexdigest()
+
+def getFrameDigests(jsonlang):
+    frames = {}
+    for c in jsonlang['chapters']:
+        for f in c['frames']:
+            frames[f['id']] = getDigest(f)
+    return frames
+
+def getChapters(jsonlang):
+    '''
+    Returns the chapters of jsonlang without their frames, by number.
+    '''
+    chapters = {}
+    for c in jsonlang['chapters']:
+        chapters[c['number']] = dict([(k, v) for k, v in c.iteritems()
+                                                          if k != 'frames'])
+    return chapters
+
+def getFields(jsonlang):
+    return dict([(k, v) for k, v in jsonlang.iteritems()
+                                 if k not in ('chapters', 'date_modified')])
+
+def getDigests(items):
+    return dict([(k, getDigest(v)) for k, v in items.iteritems()])
+
+def getState(jsonlang):
+    return { 'date_modified': jsonlang['date_modified'],
+             'frames': getFrameDigests(jsonlang),
+             'chapters': getDigests(getChapters(jsonlang)),
+             'fields': getDigests(getFields(jsonlang)),
+           }
+
+def getFrames(jsonlang):
+    frames = {}
+    for c in jsonlang['chapters']:
+        for f in c['frames']:
+            frames[f['id']] = f
+    return frames
+
+def getDelta(prevstate, curstate, jsonlang):
+    '''
+    Returns the delta between the state of the previous export and that of
+    jsonlang.  A state from before chapters and fields were recorded gives
+    all of them.
+    '''
+    prevdigests = prevstate['frames']
+    curdigests = curstate['frames']
+    frames = getFrames(jsonlang)
+    ops = {}
+    for frid, digest in curdigests.iteritems():
+        if frid not in prevdigests:
+            ops[frid] = ('added', frames[frid])
+        elif prevdigests[frid] != digest:
+            ops[frid] = ('changed', frames[frid])
+    for frid in prevdigests:
+        if frid not in curdigests:
+            ops[frid] = ('removed', frid)
+    delta = getDeltaFromOps(prevstate['date_modified'],
+                                        jsonlang['date_modified'], ops)
+    chapters = getChapters(jsonlang)
+    prevchapters = prevstate.get('chapters', {})
+    delta['chapters'] = [chapters[x] for x in sorted(chapters)
+                    if prevchapters.get(x) != curstate['chapters'][x]]
+    fields = getFields(jsonlang)
+    prevfields = prevstate.get('fields', {})
+    delta['fields'] = dict([(k, v) for k, v in fields.iteritems()
+                            if prevfields.get(k) != curstate['fields'][k]])
+    return delta
+
+def getOps(delta):
+    ops = {}
+    for op in ('added', 'changed'):
+        for f in delta[op]:
+            ops[f['id']] = (op, f)
+    for frid in delta['removed']:
+        ops[frid] = ('removed', frid)
+    return ops
+
+def getDeltaFromOps(fromdate, todate, ops):
+    delta = { 'from': fromdate,
+              'to': todate,
+              'added': [],
+              'changed': [],
+              'removed': [],
+            }
+    for frid in sorted(ops):
+        op, item = ops[frid]
+        delta[op].append(item)
+    return delta
+
+def mergeOps(a, b):
+    '''
+    Returns the single operation equivalent to applying a and then b to the
+    same frame, or None if the two cancel out.
+    '''
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a[0] == 'added':
+        if b[0] == 'removed':
+            return None
+        return ('added', b[1])
+    if a[0] == 'removed' and b[0] != 'removed':
+        return ('changed', b[1])
+    return b
+
+def mergeDeltas(a, b):
+    '''
+    Merges delta b into delta a, which must end where b starts.  Chapters
+    and fields in b replace those in a.
+    '''
+    aops = getOps(a)
+    bops = getOps(b)
+    ops = {}
+    for frid in set(aops.keys()) | set(bops.keys()):
+        op = mergeOps(aops.get(frid), bops.get(frid))
+        if op is not None:
+            ops[frid] = op
+    delta = getDeltaFromOps(a['from'], b['to'], ops)
+    chapters = {}
+    for c in a.get('chapters', []) + b.get('chapters', []):
+        chapters[c['number']] = c
+    delta['chapters'] = [chapters[x] for x in sorted(chapters)]
+    delta['fields'] = dict(a.get('fields', {}))
+    delta['fields'].update(b.get('fields', {}))
+    return delta
+
+def addDelta(feed, delta):
+    '''
+    Appends delta to feed, folding it into the last delta if both end on the
+    same date, and merges the oldest deltas until there are at most
+    maxdeltas of them.
+    '''
+    if feed and feed[-1]['to'] == delta['to']:
+        feed[-1] = mergeDeltas(feed[-1], delta)
+    else:
+        feed.append(delta)
+    while len(feed) > maxdeltas:
+        feed[0:2] = [mergeDeltas(feed[0], feed[1])]
+    return feed
+
+def updateFeed(statepath, feedpath, jsonlang):
+    '''
+    Compares jsonlang to the state in statepath and adds the delta to the
+    feed at feedpath.  A delta is added even if nothing changed, so that the
+    feed always chains from one date_modified to the next.  The first time a
+    language is seen only the state is recorded.  Returns the delta, or None
+    for a new language.
+    '''
+    curstate = getState(jsonlang)
+    prevstate = loadJSON(statepath, 'd')
+    delta = None
+    if prevstate:
+        delta = getDelta(prevstate, curstate, jsonlang)
+        feed = addDelta(loadJSON(feedpath, 'l'), delta)
+        writeFileAtomic(feedpath, getDump(feed))
+    writeFileAtomic(statepath, json.dumps(curstate, sort_keys=True))
+    return delta
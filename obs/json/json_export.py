@@ -10,6 +10,10 @@
 #
 #  Requires PyGithub for unfoldingWord export.
 
+'''
+Exports Open Bible Stories from Door43 to JSON and maintains the catalogs.
+'''
+
 import os
 import re
 import sys
@@ -17,19 +21,40 @@ import json
 import glob
 import codecs
 import shlex
+import hashlib
+import argparse
 import datetime
+import multiprocessing
+from functools import partial
+import frame_deltas
+import api_artifacts
+import catalog_store
+import parse_cache
+import json_stream
+import fileutil
+from fileutil import getDump, loadJSON, makeDir
 from subprocess import *
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                       '../../general_tools'))
+try:
+    import instrument
+except ImportError:
+    print "Please verify that general_tools/instrument.py exists."
+    sys.exit(1)
 
 
 root = '/var/www/vhosts/door43.org/httpdocs/data/gitrepo'
 pages = os.path.join(root, 'pages')
 uwadmindir = os.path.join(pages, 'en/uwadmin')
 exportdir = '/var/www/vhosts/door43.org/httpdocs/exports'
+cachedir = '/var/www/vhosts/door43.org/httpdocs/data/cache/json_export'
 unfoldingWorddir = '/var/www/vhosts/api.unfoldingword.org/httpdocs/obs/txt/1/'
 rtl = ['he', 'ar', 'fa']
 imgurl = 'https://api.unfoldingword.org/obs/jpg/1/{0}/360px/obs-{0}-{1}.jpg'
 langnames = os.path.join('/var/www/vhosts/door43.org',
                         'httpdocs/lib/plugins/translation/lang/langnames.txt')
+# Bump this whenever getChapter output changes to invalidate the manifests
+manifestversion = 2
 statusheaders = ( 'publish_date',
                   'version',
                   'contributors',
@@ -70,19 +95,25 @@ Use of trademarks: unfoldingWord is a trademark of Distant Shores Media and may
 Attribution of artwork: All images used in these stories are © Sweet Publishing (www.sweetpublishing.com) and are made available under a Creative Commons Attribution-Share Alike License (http://creativecommons.org/licenses/by-sa/3.0).
 '''
 
-# Regexes for splitting the chapter into components
-titlere = re.compile(ur'======.*', re.UNICODE)
+# Regexes for splitting the chapter into components.  A frame runs from a
+# "{{" up to the next "{", its first line is the image link and its text
+# starts on the third line.
+framere = re.compile(ur'{{([^{\n]*)(?:\n[^{\n]*(?:\n([^{]*))?)?', re.UNICODE)
 refre = re.compile(ur'//.*//', re.UNICODE)
-framere = re.compile(ur'{{[^{]*', re.DOTALL | re.UNICODE)
 fridre = re.compile(ur'[0-5][0-9]-[0-9][0-9]', re.UNICODE)
 numre = re.compile(ur'([0-5][0-9]).txt', re.UNICODE)
 
-# Regexes for removing text formatting
-htmltagre = re.compile(ur'<.*>', re.UNICODE)
-linktagre = re.compile(ur'\[\[.*\]\]', re.UNICODE)
-imgtagre = re.compile(ur'{{.*}}', re.UNICODE)
+# Messages for the warnings recorded by splitChapter
+warnmsgs = { 'title': u'NOT FOUND: title in {0}',
+             'ref': u'NOT FOUND: reference in {0}',
+             'frame_id': u'NOT FOUND: frame id in {0}',
+             'html': u'WARNING: HTML tag in {1}: {2}',
+             'link': u'WARNING: DokuWiki link tag in {1}:{2}',
+             'img': u'WARNING: DokuWiki image tag in {1}:{2}',
+           }
 imglinkre = re.compile(ur'https://.*\.(jpg|jpeg|gif)', re.UNICODE)
-
+# Warning types which leave NOT FOUND in the document
+notfoundtypes = ('title', 'ref', 'frame_id')
 obsframeset = set([
 "01-01", "01-02", "01-03", "01-04", "01-05", "01-06", "01-07", "01-08", "01-09", "01-10", "01-11", "01-12", "01-13", "01-14", "01-15", "01-16", "02-01", "02-02", "02-03", "02-04", "02-05", "02-06", "02-07", "02-08", "02-09", "02-10", "02-11", "02-12", "03-01", "03-02", "03-03", "03-04", "03-05", "03-06", "03-07", "03-08", "03-09", "03-10", "03-11", "03-12", "03-13", "03-14", "03-15", "03-16", "04-01", "04-02", "04-03", "04-04", "04-05", "04-06", "04-07", "04-08", "04-09", "05-01", "05-02", "05-03", "05-04", "05-05", "05-06", "05-07", "05-08", "05-09", "05-10", "06-01", "06-02", "06-03", "06-04", "06-05", "06-06", "06-07", "07-01", "07-02", "07-03", "07-04", "07-05", "07-06", "07-07", "07-08", "07-09", "07-10", "08-01", "08-02", "08-03", "08-04", "08-05", "08-06", "08-07", "08-08", "08-09", "08-10", "08-11", "08-12", "08-13", "08-14", "08-15", "09-01", "09-02", "09-03", "09-04", "09-05", "09-06", "09-07", "09-08", "09-09", "09-10", "09-11", "09-12", "09-13", "09-14", "09-15", "10-01", "10-02", "10-03", "10-04", "10-05", "10-06", "10-07", "10-08", "10-09", "10-10", "10-11", "10-12", "11-01", "11-02", "11-03", "11-04", "11-05", "11-06", "11-07", "11-08", "12-01", "12-02", "12-03", "12-04", "12-05", "12-06", "12-07", "12-08", "12-09", "12-10", "12-11", "12-12", "12-13", "12-14", "13-01", "13-02", "13-03", "13-04", "13-05", "13-06", "13-07", "13-08", "13-09", "13-10", "13-11", "13-12", "13-13", "13-14", "13-15", "14-01", "14-02", "14-03", "14-04", "14-05", "14-06", "14-07", "14-08", "14-09", "14-10", "14-11", "14-12", "14-13", "14-14", "14-15", "15-01", "15-02", "15-03", "15-04", "15-05", "15-06", "15-07", "15-08", "15-09", "15-10", "15-11", "15-12", "15-13", "16-01", "16-02", "16-03", "16-04", "16-05", "16-06", "16-07", "16-08", "16-09", "16-10", "16-11", "16-12", "16-13", "16-14", "16-15", "16-16", "16-17", "16-18", "17-01", "17-02", "17-03", "17-04", "17-05", "17-06", "17-07", "17-08", "17-09", "17-10", "17-11", "17-12", "17-13", "17-14", "18-01", "18-02", "18-03", "18-04", "18-05", "18-06", "18-07", "18-08", "18-09", "18-10", "18-11", "18-12", "18-13", "19-01", "19-02", "19-03", "19-04", "19-05", "19-06", "19-07", "19-08", "19-09", "19-10", "19-11", "19-12", "19-13", "19-14", "19-15", "19-16", "19-17", "19-18", "20-01", "20-02", "20-03", "20-04", "20-05", "20-06", "20-07", "20-08", "20-09", "20-10", "20-11", "20-12", "20-13", "21-01", "21-02", "21-03", "21-04", "21-05", "21-06", "21-07", "21-08", "21-09", "21-10", "21-11", "21-12", "21-13", "21-14", "21-15", "22-01", "22-02", "22-03", "22-04", "22-05", "22-06", "22-07", "23-01", "23-02", "23-03", "23-04", "23-05", "23-06", "23-07", "23-08", "23-09", "23-10", "24-01", "24-02", "24-03", "24-04", "24-05", "24-06", "24-07", "24-08", "24-09", "25-01", "25-02", "25-03", "25-04", "25-05", "25-06", "25-07", "25-08", "26-01", "26-02", "26-03", "26-04", "26-05", "26-06", "26-07", "26-08", "26-09", "26-10", "27-01", "27-02", "27-03", "27-04", "27-05", "27-06", "27-07", "27-08", "27-09", "27-10", "27-11", "28-01", "28-02", "28-03", "28-04", "28-05", "28-06", "28-07", "28-08", "28-09", "28-10", "29-01", "29-02", "29-03", "29-04", "29-05", "29-06", "29-07", "29-08", "29-09", "30-01", "30-02", "30-03", "30-04", "30-05", "30-06", "30-07", "30-08", "30-09", "31-01", "31-02", "31-03", "31-04", "31-05", "31-06", "31-07", "31-08", "32-01", "32-02", "32-03", "32-04", "32-05", "32-06", "32-07", "32-08", "32-09", "32-10", "32-11", "32-12", "32-13", "32-14", "32-15", "32-16", "33-01", "33-02", "33-03", "33-04", "33-05", "33-06", "33-07", "33-08", "33-09", "34-01", "34-02", "34-03", "34-04", "34-05", "34-06", "34-07", "34-08", "34-09", "34-10", "35-01", "35-02", "35-03", "35-04", "35-05", "35-06", "35-07", "35-08", "35-09", "35-10", "35-11", "35-12", "35-13", "36-01", "36-02", "36-03", "36-04", "36-05", "36-06", "36-07", "37-01", "37-02", "37-03", "37-04", "37-05", "37-06", "37-07", "37-08", "37-09", "37-10", "37-11", "38-01", "38-02", "38-03", "38-04", "38-05", "38-06", "38-07", "38-08", "38-09", "38-10", "38-11", "38-12", "38-13", "38-14", "38-15", "39-01", "39-02", "39-03", "39-04", "39-05", "39-06", "39-07", "39-08", "39-09", "39-10", "39-11", "39-12", "40-01", "40-02", "40-03", "40-04", "40-05", "40-06", "40-07", "40-08", "40-09", "41-01", "41-02", "41-03", "41-04", "41-05", "41-06", "41-07", "41-08", "42-01", "42-02", "42-03", "42-04", "42-05", "42-06", "42-07", "42-08", "42-09", "42-10", "42-11", "43-01", "43-02", "43-03", "43-04", "43-05", "43-06", "43-07", "43-08", "43-09", "43-10", "43-11", "43-12", "43-13", "44-01", "44-02", "44-03", "44-04", "44-05", "44-06", "44-07", "44-08", "44-09", "45-01", "45-02", "45-03", "45-04", "45-05", "45-06", "45-07", "45-08", "45-09", "45-10", "45-11", "45-12", "45-13", "46-01", "46-02", "46-03", "46-04", "46-05", "46-06", "46-07", "46-08", "46-09", "46-10", "47-01", "47-02", "47-03", "47-04", "47-05", "47-06", "47-07", "47-08", "47-09", "47-10", "47-11", "47-12", "47-13", "47-14", "48-01", "48-02", "48-03", "48-04", "48-05", "48-06", "48-07", "48-08", "48-09", "48-10", "48-11", "48-12", "48-13", "48-14", "49-01", "49-02", "49-03", "49-04", "49-05", "49-06", "49-07", "49-08", "49-09", "49-10", "49-11", "49-12", "49-13", "49-14", "49-15", "49-16", "49-17", "49-18", "50-01", "50-02", "50-03", "50-04", "50-05", "50-06", "50-07", "50-08", "50-09", "50-10", "50-11", "50-12", "50-13", "50-14", "50-15", "50-16", "50-17"
 ])
@@ -90,87 +121,258 @@ obsframeset = set([
 
 def getChapter(chapterpath, jsonchapter, lang):
     chapter = codecs.open(chapterpath, 'r', encoding='utf-8').read()
-    # Get title for chapter
-    title = titlere.search(chapter)
-    if title:
-        jsonchapter['title'] = title.group(0).replace('=', '').strip()
-    else:
-        jsonchapter['title'] = u'NOT FOUND'
-        print u'NOT FOUND: title in {0}'.format(chapterpath)
-    # Get reference for chapter
-    ref = refre.search(chapter)
-    if ref:
-        jsonchapter['ref'] = ref.group(0).replace('/', '').strip()
-    else:
-        jsonchapter['ref'] = u'NOT FOUND'
-        print u'NOT FOUND: reference in {0}'.format(chapterpath)
-    # Get the frames
-    for fr in framere.findall(chapter):
-        frlines = fr.split('\n')
-        frse = fridre.search(fr)
-        if frse:
-            frid = frse.group(0)
-        else:
-            frid = u'NOT FOUND'
-            print u'NOT FOUND: frame id in {0}'.format(chapterpath)
-        frame = { 'id': frid,
-                  'img': getImg(frlines[0].strip(), lang, frid),
-                  'text': getText(frlines[1:], lang, frid)
-                }
-        jsonchapter['frames'].append(frame)
+    return parseChapter(chapter, chapterpath, jsonchapter, lang)[0]
+
+def parseChapter(chapter, chapterpath, jsonchapter, lang):
+    '''
+    Fills in jsonchapter from the chapter page.  Returns it along with the
+    warnings from splitChapter, which are also printed.
+    '''
+    parts = splitChapter(chapter)
+    jsonchapter['title'] = parts['title']
+    jsonchapter['ref'] = parts['ref']
+    jsonchapter['frames'].extend(parts['frames'])
     # Sort frames
     jsonchapter['frames'].sort(key=lambda frame: frame['id'])
-    return jsonchapter
+    for w in parts['warnings']:
+        print warnmsgs[w['type']].format(chapterpath, lang, w['frame'])
+    return jsonchapter, parts['warnings']
 
-def getImg(link, lang, frid):
+def splitChapter(chapter):
+    '''
+    Splits a chapter page into its title, reference and frames.  framere
+    splits each frame into its image line and text.  Returns a dict of the
+    parts along with a list of warnings, each of which is a dict with a type
+    (a key of warnmsgs) and the frame id it applies to, so callers can count
+    or report them instead of only printing them.
+    '''
+    warnings = []
+    title = u'NOT FOUND'
+    start = chapter.find(u'======')
+    if start != -1:
+        title = chapter[start:getEOL(chapter, start)].replace(u'=', u'').strip()
+    else:
+        warnings.append({ 'type': 'title', 'frame': None })
+    refse = refre.search(chapter)
+    if refse:
+        ref = refse.group(0).replace(u'/', u'').strip()
+    else:
+        ref = u'NOT FOUND'
+        warnings.append({ 'type': 'ref', 'frame': None })
+    frames = [getFrame(x, warnings) for x in framere.finditer(chapter)]
+    return { 'title': title,
+             'ref': ref,
+             'frames': frames,
+             'warnings': warnings,
+           }
+
+def getEOL(text, start):
+    eol = text.find(u'\n', start)
+    if eol == -1:
+        return len(text)
+    return eol
+
+def getFrame(frse, warnings):
+    '''
+    Builds a frame from a framere match: the image link is on the first line
+    and the text starts on the third.  Warnings are appended to warnings.
+    '''
+    idse = fridre.search(frse.group(0))
+    if idse:
+        frid = idse.group(0)
+    else:
+        frid = u'NOT FOUND'
+        warnings.append({ 'type': 'frame_id', 'frame': frid })
+    img, text = frse.group(1, 2)
+    return { 'id': frid,
+             'img': getImg(img.strip(), frid),
+             'text': getText(text or u'', frid, warnings),
+           }
+
+def getChapterCached(chapterpath, jsonchapter, lang, manifest, newmanifest):
+    '''
+    Returns the parsed chapter from the manifest if the file is unchanged,
+    otherwise parses it.  A size and mtime match skips reading the file, a
+    digest match skips parsing it.  The entry is recorded in newmanifest.
+    Returns the chapter and its parse warnings.
+    '''
+    name = os.path.basename(chapterpath)
+    st = os.stat(chapterpath)
+    entry = manifest.get(name)
+    if ( entry and entry['size'] == st.st_size and
+                                            entry['mtime'] == st.st_mtime ):
+        newmanifest[name] = entry
+        instrument.count('chapters_cached')
+        return entry['chapter'], entry['warnings']
+    raw = open(chapterpath, 'rb').read()
+    instrument.count('files_read')
+    digest = hashlib.sha1(raw).hexdigest()
+    if entry and entry['digest'] == digest:
+        chapter, warnings = entry['chapter'], entry['warnings']
+    else:
+        chapter, warnings = parseChapter(raw.decode('utf-8'), chapterpath,
+                                                           jsonchapter, lang)
+    newmanifest[name] = { 'size': st.st_size,
+                          'mtime': st.st_mtime,
+                          'digest': digest,
+                          'chapter': chapter,
+                          'warnings': warnings,
+                        }
+    return chapter, warnings
+
+def getManifestPath(lang):
+    return os.path.join(cachedir, lang, 'manifest.json')
+
+def loadManifest(lang, full):
+    '''
+    Returns the chapter manifest for lang, or an empty one if full is set or
+    the manifest was written by an older version of getChapter.
+    '''
+    if full:
+        return {}
+    manifest = loadJSON(getManifestPath(lang), 'd')
+    if manifest.get('version') != manifestversion:
+        return {}
+    return manifest['chapters']
+
+def getParseCachePath():
+    return os.path.join(cachedir, 'parse_cache.marshal')
+
+def saveManifest(lang, chapters):
+    manifest = { 'version': manifestversion,
+                 'chapters': chapters,
+               }
+    writeFileAtomic(getManifestPath(lang), json.dumps(manifest))
+
+def getImg(link, frid):
     linkse = imglinkre.search(link)
     if linkse:
-        link = linkse.group(0)
-        return link
+        return linkse.group(0)
     return imgurl.format('en', frid)
 
-def getText(lines, lang, frid):
+def getText(text, frid, warnings):
     '''
-    Cleans up text from possible DokuWiki and HTML pollution.
+    Cleans up text from possible DokuWiki and HTML pollution.  Lines with a
+    "//" in them are dropped and the rest are joined together.
     '''
-    text = u''.join([x for x in lines[1:] if u'//' not in x]).strip()
+    if u'//' in text:
+        text = u''.join([x for x in text.split(u'\n') if u'//' not in x])
+    else:
+        text = text.replace(u'\n', u'')
+    text = text.strip()
     text = text.replace(u'\\\\', u'').replace(u'**', u'').replace(u'__', u'')
-    if htmltagre.search(text):
-        text = htmltagre.sub(u'', text)
-        print u'WARNING: HTML tag in {0}: {1}'.format(lang, frid)
-    if linktagre.search(text):
-        text = linktagre.sub(u'', text)
-        print u'WARNING: DokuWiki link tag in {0}:{1}'.format(lang, frid)
-    if imgtagre.search(text):
-        text = imgtagre.sub(u'', text)
-        print u'WARNING: DokuWiki image tag in {0}:{1}'.format(lang, frid)
+    if u'<' in text:
+        text = stripTag(text, u'<', u'>', 'html', frid, warnings)
+    if u'[[' in text:
+        text = stripTag(text, u'[[', u']]', 'link', frid, warnings)
+    if u'{{' in text:
+        text = stripTag(text, u'{{', u'}}', 'img', frid, warnings)
     return text
-        
+
+def stripTag(text, opentag, closetag, wtype, frid, warnings):
+    '''
+    Drops everything from the first opentag to the last closetag after it,
+    the same span a greedy regex would match.
+    '''
+    start = text.find(opentag)
+    end = text.rfind(closetag)
+    if end < start + len(opentag):
+        return text
+    warnings.append({ 'type': wtype, 'frame': frid })
+    return text[:start] + text[end + len(closetag):]
+
 def writePage(outfile, p):
     makeDir(outfile.rpartition('/')[0])
     f = codecs.open(outfile.replace('.txt', '.json'), 'w', encoding='utf-8')
     f.write(p)
     f.close()
+    instrument.count('files_written')
+    instrument.countBytes('bytes_written', p)
 
-def makeDir(d):
-    if not os.path.exists(d):
-        os.makedirs(d, 0755)
+def writeFileAtomic(outfile, p):
+    '''
+    Writes p with fileutil.writeFileAtomic and counts it.
+    '''
+    fileutil.writeFileAtomic(outfile, p)
+    instrument.count('files_written')
+    instrument.countBytes('bytes_written', p)
 
-def getDump(j):
-    return json.dumps(j, sort_keys=True, indent=2)
+def getDigest(jsonlang):
+    '''
+    Returns the SHA-1 of the canonical form of a language document (or of a
+    chapter).  The date_modified key is left out so that a new day is not
+    counted as a change.
+    '''
+    canon = dict([(k, v) for k, v in jsonlang.iteritems()
+                                                   if k != 'date_modified'])
+    return hashlib.sha1(json.dumps(canon, sort_keys=True,
+                                      separators=(',', ':'))).hexdigest()
 
-def loadJSON(f, t):
-    if os.path.isfile(f):
-        return json.load(open(f, 'r'))
-    if t == 'd':
-      return json.loads('{}')
-    else:
-      return json.loads('[]')
+def loadDigest(jsonlangfilepath):
+    '''
+    Returns the digest recorded for a previous export, or None if there is
+    no previous export.  Exports written before the digest sidecar existed
+    are loaded and digested once.
+    '''
+    if not os.path.isfile(jsonlangfilepath):
+        return None
+    digestpath = '{0}.sha1'.format(jsonlangfilepath)
+    if os.path.isfile(digestpath):
+        return open(digestpath, 'r').read().strip()
+    return getDigest(loadJSON(jsonlangfilepath, 'd'))
+
+def getFeedPath(jsonlangfilepath):
+    return '{0}.deltas.json'.format(jsonlangfilepath.rpartition('.json')[0])
+
+def getShardDir(jsonlangfilepath):
+    return jsonlangfilepath.rpartition('.json')[0]
+
+def writeShards(jsonlangfilepath, jsonlang):
+    '''
+    Writes each chapter of jsonlang to its own file, in a directory named
+    after the export (obs-en/01.json and so on), with an index.json listing
+    the chapters, their frame counts and the digest of each shard.  Only
+    shards whose digest differs from the previous index are rewritten.
+    '''
+    sharddir = getShardDir(jsonlangfilepath)
+    indexpath = os.path.join(sharddir, 'index.json')
+    previndex = loadJSON(indexpath, 'd')
+    prevdigests = dict([(x['number'], x['digest'])
+                                     for x in previndex.get('chapters', [])])
+    chapters = []
+    for c in jsonlang['chapters']:
+        digest = getDigest(c)
+        shardpath = os.path.join(sharddir, '{0}.json'.format(c['number']))
+        if ( prevdigests.get(c['number']) != digest or
+                                             not os.path.isfile(shardpath) ):
+            writeFileAtomic(shardpath, getDump(c))
+        chapters.append({ 'number': c['number'],
+                          'title': c['title'],
+                          'frames': len(c['frames']),
+                          'digest': digest,
+                        })
+    for number in prevdigests:
+        shardpath = os.path.join(sharddir, '{0}.json'.format(number))
+        if number not in [x['number'] for x in chapters] and os.path.isfile(
+                                                                  shardpath):
+            os.remove(shardpath)
+    index = { 'language': jsonlang['language'],
+              'direction': jsonlang['direction'],
+              'app_words': jsonlang['app_words'],
+              'chapters': chapters,
+              'date_modified': jsonlang['date_modified'],
+            }
+    if getDigest(index) != getDigest(previndex):
+        writeFileAtomic(indexpath, getDump(index))
 
 def loadLangStrings(path):
-    langdict = {}
     if not os.path.isfile(path):
-        return langdict
+        return {}
+    return parse_cache.getParsed(path, 'langstrings', parseLangStrings)
+
+def parseLangStrings(path):
+    langdict = {}
+    instrument.count('files_read')
     for line in codecs.open(path, 'r', encoding='utf-8').readlines():
         if ( line.startswith(u'#') or line.startswith(u'\n')
                                                   or line.startswith(u'\r') ):
@@ -180,14 +382,19 @@ def loadLangStrings(path):
     return langdict
 
 def getJSONDict(statfile):
+    if not os.path.isfile(statfile):
+        return {}
+    return parse_cache.getParsed(statfile, 'keyvalue', parseJSONDict)
+
+def parseJSONDict(statfile):
     status = {}
-    if os.path.isfile(statfile):
-        for line in open(statfile):
-            if ( line.startswith('#') or line.startswith('\n')
-                                                         or ':' not in line ):
-                continue
-            k, v = line.split(':', 1)
-            status[k.strip().lower().replace(' ', '_')] = v.strip()
+    instrument.count('files_read')
+    for line in open(statfile):
+        if ( line.startswith('#') or line.startswith('\n')
+                                                     or ':' not in line ):
+            continue
+        k, v = line.split(':', 1)
+        status[k.strip().lower().replace(' ', '_')] = v.strip()
     return status
 
 def cleanStatus(status):
@@ -205,6 +412,9 @@ def exportunfoldingWord(status, gitdir, json, lang, githuborg):
     statjson = getDump(cleanStatus(status))
     writePage(os.path.join(gitdir, 'status-{0}.json'.format(lang)), statjson)
     writePage(os.path.join(gitdir, 'README.md'), readme)
+    # Shards and the delta feed are served from the checkout but not pushed
+    writePage(os.path.join(gitdir, '.gitignore'),
+                  api_artifacts.gitignore + u'obs-*/\n*.deltas.json\n')
     gitCreate(gitdir)
     name = 'obs-{0}'.format(lang)
     desc = 'Open Bible Stories for {0}'.format(lang)
@@ -214,154 +424,405 @@ def exportunfoldingWord(status, gitdir, json, lang, githuborg):
     gitCommit(gitdir, commitmsg)
     gitPush(gitdir)
 
-def uwQA(jsd, lang, status):
+def getQA(jsonlang, status, warnings):
     '''
-    Implements basic quality control to verify correct number of frames,
-    correct JSON formatting, and correct status headers.
+    Checks a language document for missing, extra and duplicate frames and
+    its status page for missing headers.  Returns a record of the problems
+    found, including the parse warnings (missing title, reference or frame
+    id and leftover markup).
     '''
-    flag = True
-    for header in statusheaders:
-        if not status.has_key(header):
-            print ('==> !! Cannot export {0}, status page missing header {1}'
-                                                        .format(lang, header))
-            flag = False
-    if 'NOT FOUND.' in str(jsd):
-        print '==> !! Cannot export {0}, invalid JSON format'.format(lang)
-        flag = False
-    framelist = []
+    frameset = set()
+    duplicates = set()
     for c in jsonlang['chapters']:
         for f in c['frames']:
-            framelist.append(f['id'])
-    frameset = set(framelist)
-    obslangdiff = obsframeset.difference(frameset)
-    if obslangdiff:
+            if f['id'] in frameset:
+                duplicates.add(f['id'])
+            frameset.add(f['id'])
+    qa = { 'missing_frames': sorted(obsframeset.difference(frameset)),
+           'extra_frames': sorted(frameset.difference(obsframeset)),
+           'duplicate_frames': sorted(duplicates),
+           'missing_headers': [x for x in statusheaders if x not in status],
+           'not_found': [x for x in warnings if x['type'] in notfoundtypes],
+           'markup': [x for x in warnings if x['type'] not in notfoundtypes],
+         }
+    qa['ok'] = not ( qa['missing_frames'] or qa['extra_frames'] or
+                     qa['duplicate_frames'] or qa['missing_headers'] or
+                     qa['not_found'] )
+    return qa
+
+def uwQA(qa, lang):
+    '''
+    Prints the problems in a getQA record for an unfoldingWord export.
+    Returns False if the status page is missing a header or the language
+    is missing frames or has extra frames.  Parse warnings and duplicate
+    frames are only printed, they do not stop the export.
+    '''
+    for header in qa['missing_headers']:
+        print ('==> !! Cannot export {0}, status page missing header {1}'
+                                                        .format(lang, header))
+    if qa['not_found']:
+        print ('WARNING: {0} has {1} frames with a missing title, reference or'
+               ' id'.format(lang, len(qa['not_found'])))
+    if qa['duplicate_frames']:
+        print 'WARNING: {0} has duplicate frames:'.format(lang)
+        for x in qa['duplicate_frames']:
+            print x
+    if qa['missing_frames']:
         print '==> !! Cannot export {0}, missing frames:'.format(lang)
-        for x in obslangdiff:
+        for x in qa['missing_frames']:
             print x
-        flag = False
-    langobsdiff = frameset.difference(obsframeset)
-    if langobsdiff:
+    if qa['extra_frames']:
         print '==> !! Cannot export {0}, extra frames:'.format(lang)
-        for x in langobsdiff:
+        for x in qa['extra_frames']:
             print x
-        flag = False
-    # Tests passed, return true
-    return flag
+    return not ( qa['missing_headers'] or qa['missing_frames'] or
+                 qa['extra_frames'] )
 
-def updateUWAdminStatusPage():
-    sys.path.append('/var/www/vhosts/door43.org/tools/obs/dokuwiki')
-    try:
-        import obs_published_langs
-    except:
-        print 'Could not import obs_published_langs, check path.'
-    obs_published_langs.updatePage(obs_published_langs.caturl,
-                                              obs_published_langs.uwstatpage)
+def getLangs(pagesdir):
+    '''
+    Returns the language namespaces in pagesdir that have an obs directory.
+    '''
+    return [x for x in os.listdir(pagesdir) if isOBSLang(pagesdir, x)]
 
-if __name__ == '__main__':
-    unfoldingwordexport = False
-    if len(sys.argv) > 1:
-        if sys.argv[1] == '--unfoldingwordexport':
-            sys.path.append('/var/www/vhosts/door43.org/tools/general_tools')
-            try:
-                from git_wrapper import *
-            except:
-                print "Please verify that"
-                print "/var/www/vhosts/door43.org/tools/general_tools exists."
-                sys.exit(1)
-            try:
-                from github import Github
-                from github import GithubException
-            except:
-                print "Please install PyGithub with pip"
-                sys.exit(1)
-            unfoldingwordexport = True
-            # Log in to Github via API
-            try:
-                pw = open('/root/.github_pass', 'r').read().strip()
-                guser = githubLogin('dsm-git', pw)
-                githuborg = getGithubOrg('unfoldingword', guser)
-            except GithubException as e:
-                print 'Problem logging into Github: {0}'.format(e)
-                sys.exit(1)
+def isOBSLang(pagesdir, lang):
+    '''
+    Returns True if lang is a language namespace with an obs directory.
+    '''
+    if lang in ['playground', 'template']:
+        return False
+    langdir = os.path.join(pagesdir, lang)
+    return ( os.path.isdir(langdir) and
+                                  os.path.exists(os.path.join(langdir, 'obs')) )
+
+def getLangJSON(lang, today, full=False):
+    '''
+    Parses all of the chapters for lang into the language document.  Chapters
+    which are unchanged since the last run are loaded from the manifest.
+    Returns the document and the parse warnings, tagged with their chapter.
+    '''
+    app_words = getJSONDict(os.path.join(pages, lang, 'obs/app_words.txt'))
+    langdirection = 'ltr'
+    if lang in rtl:
+        langdirection = 'rtl'
+    jsonlang = { 'language': lang,
+                 'direction': langdirection,
+                 'chapters': [],
+                 'app_words': app_words,
+                 'date_modified': today,
+               }
+    page_list = glob.glob('{0}/{1}/obs/[0-5][0-9].txt'.format(pages, lang))
+    page_list.sort()
+    manifest = loadManifest(lang, full)
+    newmanifest = {}
+    warnings = []
+    for page in page_list:
+        jsonchapter = { 'number': numre.search(page).group(1),
+                        'frames': [],
+                      }
+        chapter, chpwarnings = getChapterCached(page, jsonchapter, lang,
+                                                         manifest, newmanifest)
+        jsonlang['chapters'].append(chapter)
+        for w in chpwarnings:
+            warnings.append({ 'chapter': chapter['number'],
+                              'type': w['type'],
+                              'frame': w['frame'],
+                            })
+    jsonlang['chapters'].sort(key=lambda frame: frame['number'])
+    if full or newmanifest != manifest:
+        saveManifest(lang, newmanifest)
+    return jsonlang, warnings
+
+def isPublishable(status):
+    '''
+    Returns True if the status page says the language publishes today.
+    '''
+    if not ( status.has_key('checking_level') and
+                                            status.has_key('publish_date') ):
+        return False
+    return ( status['checking_level'] in ['1', '2', '3'] and
+                       status['publish_date'] == str(datetime.date.today()) )
+
+def exportLang(lang, langstr, today, opts):
+    '''
+    Parses, serializes and writes the JSON for a single language.  Returns a
+    small record which the coordinator merges into the catalogs.  The full
+    document is only handed back when the language is due for unfoldingWord.
+    '''
+    with instrument.span('parse', lang):
+        jsonlang, warnings = getLangJSON(lang, today, opts['full'])
+    jsonlangfilepath = os.path.join(exportdir, lang, 'obs',
+                                        'obs-{0}.json'.format(lang))
+    curdigest = getDigest(jsonlang)
+    status = getJSONDict(os.path.join(uwadmindir, lang, 'obs/status.txt'))
+    langcat =  { 'language': lang,
+                 'string': langstr,
+                 'direction': jsonlang['direction'],
+                 'date_modified': today,
+                 'status': status,
+               }
+    langrec = { 'language': lang,
+                'langcat': langcat,
+                'changed': False,
+                'publish': False,
+                'json': None,
+                'qa': getQA(jsonlang, status, warnings),
+              }
+    if curdigest != loadDigest(jsonlangfilepath):
+        langrec['changed'] = True
+        with instrument.span('write', lang):
+            makeDir(os.path.dirname(jsonlangfilepath))
+            size = json_stream.writeJSON(jsonlangfilepath, jsonlang)[1]
+            instrument.count('files_written')
+            instrument.count('bytes_written', size)
+            writeFileAtomic('{0}.sha1'.format(jsonlangfilepath), curdigest)
+    if opts['deltas'] and langrec['changed']:
+        with instrument.span('deltas', lang):
+            frame_deltas.updateFeed(os.path.join(cachedir, lang,
+                    'frames.json'), getFeedPath(jsonlangfilepath), jsonlang)
+    if opts['shards'] and ( langrec['changed'] or not os.path.isfile(
+            os.path.join(getShardDir(jsonlangfilepath), 'index.json')) ):
+        with instrument.span('shards', lang):
+            writeShards(jsonlangfilepath, jsonlang)
+    if opts['minify'] and os.path.isfile(jsonlangfilepath):
+        with instrument.span('minify', lang):
+            api_artifacts.writeArtifacts(jsonlangfilepath, curdigest,
+                                                              opts['brotli'])
+    if opts['uwexport'] and isPublishable(status):
+        print "=========="
+        if not uwQA(langrec['qa'], lang):
+            print "=========="
         else:
-            print 'Unknown argument: {0}'.format(sys.argv[1])
-    today = ''.join(str(datetime.date.today()).rsplit('-')[0:3])
+            langrec['publish'] = True
+            langrec['json'] = getDump(jsonlang)
+    return langrec
+
+def exportLangWorker(args):
+    '''
+    Unpacks the arguments for exportLang when run from a process pool.  The
+    instrumentation records and new parse cache entries are handed back with
+    the result.
+    '''
+    with instrument.span('language', args[0]):
+        langrec = exportLang(*args)
+    langrec['metrics'] = instrument.collect()
+    langrec['parsed'] = parse_cache.collect()
+    return langrec
+
+def initWorker():
+    '''
+    Drops the records a pool worker inherited from the parent.
+    '''
+    instrument.reset()
+    parse_cache.reset()
+
+def mapLangs(func, arglist, jobs):
+    '''
+    Runs func over arglist, in a pool of jobs worker processes if jobs is
+    more than one.  Results are returned in the same order as arglist.
+    '''
+    if jobs < 2 or len(arglist) < 2:
+        return [func(x) for x in arglist]
+    pool = multiprocessing.Pool(min(jobs, len(arglist)), initWorker)
+    try:
+        return pool.map(func, arglist, 1)
+    finally:
+        pool.close()
+        pool.join()
+
+def runExport(today, opts, githuborg=None):
+    '''
+    Exports every language, then merges the per-language records into the
+    Door43 export catalog and (optionally) the unfoldingWord catalog.  The
+    QA records of all the languages are written to one report.
+    '''
+    parse_cache.setPath(getParseCachePath())
     langdict = loadLangStrings(langnames)
-    uwcatpath = os.path.join(unfoldingWorddir, 'obs-catalog.json')
-    uwcatalog = loadJSON(uwcatpath, 'l')
-    uwcatlangs = [x['language'] for x in uwcatalog]
-    catpath = os.path.join(exportdir, 'obs-catalog.json')
-    catalog = loadJSON(catpath, 'l')
-    for lang in os.listdir(pages):
-        if ( os.path.isfile(os.path.join(pages, lang)) or
-             'obs' not in os.listdir(os.path.join(pages, lang)) ):
+    qareport = { 'date_modified': today,
+                 'languages': {},
+               }
+    arglist = []
+    for lang in getLangs(pages):
+        if lang not in langdict:
+            print "Configuration for language {0} missing in {1}.".format(lang,
+                                                                     langnames)
+            qareport['languages'][lang] = { 'ok': False,
+                                            'missing_langname': True,
+                                          }
             continue
-        if lang in ['playground', 'template']:
+        arglist.append((lang, langdict[lang], today, opts))
+    with instrument.span('export_langs'):
+        langrecs = mapLangs(exportLangWorker, arglist, opts['jobs'])
+    mergeLangRecs(langrecs, qareport, today, opts, githuborg)
+
+def exportChanged(langs, opts, githuborg=None):
+    '''
+    Re-exports only the given languages, for --watch.  Their catalog entries
+    (including the status) and QA records are updated, the rest are left as
+    they are.
+    '''
+    today = getToday()
+    parse_cache.setPath(getParseCachePath())
+    langdict = loadLangStrings(langnames)
+    qareport = loadJSON(os.path.join(exportdir, 'obs-qa.json'), 'd')
+    qareport['date_modified'] = today
+    qareport.setdefault('languages', {})
+    langrecs = []
+    for lang in langs:
+        if not isOBSLang(pages, lang):
             continue
-        app_words = getJSONDict(os.path.join(pages, lang, 'obs/app_words.txt'))
-        langdirection = 'ltr'
-        if lang in rtl:
-            langdirection = 'rtl'
-        jsonlang = { 'language': lang,
-                     'direction': langdirection,
-                     'chapters': [],
-                     'app_words': app_words,
-                     'date_modified': today,
-                   }
-        page_list = glob.glob('{0}/{1}/obs/[0-5][0-9].txt'.format(pages, lang))
-        page_list.sort()
-        for page in page_list:
-            jsonchapter = { 'number': numre.search(page).group(1),
-                            'frames': [],
-                          }
-            jsonlang['chapters'].append(getChapter(page, jsonchapter, lang))
-        jsonlang['chapters'].sort(key=lambda frame: frame['number'])
-        jsonlangfilepath = os.path.join(exportdir, lang, 'obs',
-                                            'obs-{0}.json'.format(lang))
-        prevjsonlang = loadJSON(jsonlangfilepath, 'd')
-        curjson = getDump(jsonlang)
-        prevjson = getDump(prevjsonlang)
-        try:
-            langstr = langdict[lang]
-        except KeyError:
+        if lang not in langdict:
             print "Configuration for language {0} missing in {1}.".format(lang,
                                                                      langnames)
+            qareport['languages'][lang] = { 'ok': False,
+                                            'missing_langname': True,
+                                          }
             continue
-        status = getJSONDict(os.path.join(uwadmindir, lang, 'obs/status.txt'))
-        langcat =  { 'language': lang,
-                     'string': langstr,
-                     'direction': langdirection,
-                     'date_modified': today,
-                     'status': status,
-                   }
-        if not lang in [x['language'] for x in catalog]:
-            catalog.append(langcat)
-        # Maybe fix this to do a full string comparison
-        if len(str(curjson)) != len(str(prevjson)):
-            ( [x for x in catalog if x['language'] ==
-                                            lang][0]['date_modified']) = today
-            writePage(jsonlangfilepath, curjson)
-        if unfoldingwordexport:
+        print "---> Updating {0}".format(lang)
+        langrecs.append(exportLangWorker((lang, langdict[lang], today, opts)))
+    mergeLangRecs(langrecs, qareport, today, opts, githuborg, True)
+    if opts['metrics']:
+        instrument.writeSummary(opts['metrics'])
+
+def mergeLangRecs(langrecs, qareport, today, opts, githuborg=None,
+                                                                refresh=False):
+    '''
+    Merges the records from exportLang into the catalogs and qareport,
+    publishes the languages that are due for unfoldingWord and writes it all
+    out.  With refresh the string and status of existing catalog entries are
+    updated too.
+    '''
+    uwcatpath = os.path.join(unfoldingWorddir, 'obs-catalog.json')
+    uwcatalog = catalog_store.loadCatalog(uwcatpath)
+    catpath = os.path.join(exportdir, 'obs-catalog.json')
+    catalog = catalog_store.loadCatalog(catpath)
+    for langrec in langrecs:
+        lang = langrec['language']
+        langcat = langrec['langcat']
+        instrument.merge(langrec['metrics'])
+        parse_cache.merge(langrec['parsed'])
+        qareport['languages'][lang] = langrec['qa']
+        if not catalog_store.addEntry(catalog, langcat) and refresh:
+            catalog_store.updateEntry(catalog, lang, {
+                                            'string': langcat['string'],
+                                            'status': langcat['status'] })
+        if langrec['changed']:
+            catalog_store.updateEntry(catalog, lang, { 'date_modified': today })
+        if langrec['publish']:
+            print "---> Exporting to unfoldingWord: {0}".format(lang)
             unfoldingWordlangdir = os.path.join(unfoldingWorddir, lang)
-            if status.has_key('checking_level') and status.has_key(
-                                                              'publish_date'):
-                if ( status['checking_level'] in ['1', '2', '3'] and 
-                       status['publish_date'] == str(datetime.date.today()) ):
-                    print "=========="
-                    if not uwQA(jsonlang, lang, status):
-                        print "=========="
-                        continue
-                    print "---> Exporting to unfoldingWord: {0}".format(lang)
-                    exportunfoldingWord(status, unfoldingWordlangdir, curjson,
-                                                              lang, githuborg)
-                    if lang in uwcatlangs:
-                        uwcatalog.pop(uwcatlangs.index(lang))
-                        uwcatlangs.pop(uwcatlangs.index(lang))
-                    uwcatalog.append(langcat)
-                    print "=========="
-    catjson = getDump(catalog)
-    writePage(catpath, catjson)
-    if unfoldingwordexport:
-        uwcatjson = getDump(uwcatalog)
-        writePage(uwcatpath, uwcatjson)
-        updateUWAdminStatusPage()
+            with instrument.span('publish', lang):
+                exportunfoldingWord(langcat['status'], unfoldingWordlangdir,
+                                           langrec['json'], lang, githuborg)
+            uwjsonpath = os.path.join(unfoldingWordlangdir,
+                                                  'obs-{0}.json'.format(lang))
+            if opts['shards'] or opts['deltas']:
+                uwjsonlang = json.loads(langrec['json'])
+            if opts['deltas']:
+                frame_deltas.updateFeed(os.path.join(cachedir, lang,
+                                   'uw-frames.json'), getFeedPath(uwjsonpath),
+                                   uwjsonlang)
+            if opts['shards']:
+                writeShards(uwjsonpath, uwjsonlang)
+            if opts['minify']:
+                api_artifacts.writeArtifacts(uwjsonpath,
+                                    hashlib.sha1(langrec['json']).hexdigest(),
+                                    opts['brotli'])
+            catalog_store.replaceEntry(uwcatalog, langcat)
+            print "=========="
+    with instrument.span('catalog'):
+        catalog_store.commitCatalog(catalog)
+    qareport['summary'] = { 'languages': len(qareport['languages']),
+                            'ok': len([x for x in qareport['languages']
+                                  .itervalues() if x['ok']]),
+                          }
+    writeFileAtomic(os.path.join(exportdir, 'obs-qa.json'), getDump(qareport))
+    parse_cache.save()
+    if opts['uwexport']:
+        with instrument.span('catalog'):
+            catalog_store.commitCatalog(uwcatalog)
+            updateUWAdminStatusPage(uwcatpath)
+
+def getToday():
+    return ''.join(str(datetime.date.today()).rsplit('-')[0:3])
+
+def updateUWAdminStatusPage(uwcatpath):
+    sys.path.append('/var/www/vhosts/door43.org/tools/obs/dokuwiki')
+    try:
+        import obs_published_langs
+    except:
+        print 'Could not import obs_published_langs, check path.'
+    obs_published_langs.updatePage(uwcatpath, obs_published_langs.uwstatpage)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--unfoldingwordexport', dest="uwexport",
+        action='store_true', default=False,
+        help="Also publish to the unfoldingWord API and Github")
+    parser.add_argument('-j', '--jobs', dest="jobs", type=int, default=1,
+        help="Number of worker processes to export languages with")
+    parser.add_argument('--full', dest="full", action='store_true',
+        default=False, help="Ignore the chapter manifests and reparse all")
+    parser.add_argument('--shards', dest="shards", action='store_true',
+        default=False, help="Also write a file per chapter and an index")
+    parser.add_argument('--deltas', dest="deltas", action='store_true',
+        default=False, help="Also keep a frame level delta feed")
+    parser.add_argument('--minify', dest="minify", action='store_true',
+        default=False, help="Also write minified and gzipped JSON")
+    parser.add_argument('--brotli', dest="brotli", action='store_true',
+        default=False, help="With --minify, also write brotli files")
+    parser.add_argument('--metrics', dest="metrics", default=None,
+        help="Write timings and counters to this file (.prom for the "
+             "Prometheus textfile format, JSON otherwise)")
+    parser.add_argument('--watch', dest="watch", action='store_true',
+        default=False, help="After the export, keep running and re-export "
+                            "languages as their pages change")
+    parser.add_argument('--delay', dest="delay", type=float, default=2.0,
+        help="With --watch, seconds without writes before re-exporting")
+    args = parser.parse_args(sys.argv[1:])
+    if args.brotli and not api_artifacts.hasBrotli():
+        print "Please install brotli with pip"
+        sys.exit(1)
+    if args.watch:
+        import lang_watch
+    if args.metrics:
+        instrument.enable('json_export')
+    githuborg = None
+    if args.uwexport:
+        sys.path.append('/var/www/vhosts/door43.org/tools/general_tools')
+        try:
+            from git_wrapper import *
+        except:
+            print "Please verify that"
+            print "/var/www/vhosts/door43.org/tools/general_tools exists."
+            sys.exit(1)
+        try:
+            from github import Github
+            from github import GithubException
+        except:
+            print "Please install PyGithub with pip"
+            sys.exit(1)
+        # Log in to Github via API
+        try:
+            pw = open('/root/.github_pass', 'r').read().strip()
+            guser = githubLogin('dsm-git', pw)
+            githuborg = getGithubOrg('unfoldingword', guser)
+        except GithubException as e:
+            print 'Problem logging into Github: {0}'.format(e)
+            sys.exit(1)
+    opts = { 'jobs': args.jobs,
+             'uwexport': args.uwexport,
+             'full': args.full,
+             'shards': args.shards,
+             'deltas': args.deltas,
+             'minify': args.minify,
+             'brotli': args.brotli,
+             'metrics': args.metrics,
+           }
+    with instrument.span('total'):
+        runExport(getToday(), opts, githuborg)
+    if args.metrics:
+        instrument.writeSummary(args.metrics)
+    if args.watch:
+        lang_watch.watch([pages, uwadmindir], partial(exportChanged, opts=opts,
+                         githuborg=githuborg), args.delay, args.delay * 15)
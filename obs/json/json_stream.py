@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#  Copyright (c) 2014 unfoldingWord
+#  http://creativecommons.org/licenses/MIT/
+#  See LICENSE file for details.
+#
+#  Contributors:
+#  Jesse Griffin <jesse@distantshores.org>
+#
+
+'''
+Writes JSON documents to disk a piece at a time.
+
+writeJSON gives the same bytes as json.dumps(j, indent=2, sort_keys=True),
+but the encoder's output is written as it is produced, in blocks of about
+blocksize bytes, so a large document (a language's OBS, tN or key terms)
+never has to sit in memory as one string.  It is written to a temporary
+file next to the target which is renamed into place, so readers never see a
+partially written file.
+'''
+
+import os
+import json
+import hashlib
+from fileutil import getTmpPath
+
+blocksize = 65536
+
+
+def iterDump(j):
+    '''
+    Yields the pieces of json.dumps(j, indent=2, sort_keys=True).
+    '''
+    return json.JSONEncoder(indent=2, sort_keys=True).iterencode(j)
+
+def writeJSON(outfile, j):
+    '''
+    Writes j to outfile.  Returns the SHA-1 of what was written and its
+    length in bytes.
+    '''
+    tmpfile = getTmpPath(outfile)
+    sha = hashlib.sha1()
+    size = 0
+    block = []
+    blocklen = 0
+    f = open(tmpfile, 'wb')
+    try:
+        for chunk in iterDump(j):
+            block.append(chunk)
+            blocklen += len(chunk)
+            if blocklen >= blocksize:
+                size += writeBlock(f, sha, block)
+                block = []
+                blocklen = 0
+        size += writeBlock(f, sha, block)
+        f.close()
+    except:
+        f.close()
+        os.remove(tmpfile)
+        raise
+    os.rename(tmpfile, outfile)
+    return sha.hexdigest(), size
+
+def writeBlock(f, sha, block):
+    data = ''.join(block)
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    f.write(data)
+    sha.update(data)
+    return len(data)
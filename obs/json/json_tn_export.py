@@ -20,26 +20,39 @@ import sys
 import json
 import glob
 import codecs
+import hashlib
+import argparse
 import datetime
+import multiprocessing
+import kt_matcher
+import json_stream
+import api_artifacts
+import fileutil
+from collections import OrderedDict
+from fileutil import makeDir
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                       '../../general_tools'))
+try:
+    import instrument
+except ImportError:
+    print "Please verify that general_tools/instrument.py exists."
+    sys.exit(1)
 
 
 root = '/var/www/vhosts/door43.org/httpdocs/data/gitrepo'
 pages = os.path.join(root, 'pages')
 api = '/var/www/vhosts/api.unfoldingword.org/httpdocs/obs/txt/1/'
-ktaliases = {}
+cachedir = '/var/www/vhosts/door43.org/httpdocs/data/cache/json_tn_export'
+
+# Bump this whenever parseFrame or parseKT output changes to invalidate the
+# manifests
+manifestversion = 3
 
 # Regexes for grabbing content
-ktre = re.compile(ur'====== (.*?) ======', re.UNICODE)
-subre = re.compile(ur'\n==== (.*) ====\n', re.UNICODE)
-defre = re.compile(ur'===== Definition: =====(.*?)\[See also', re.UNICODE | re.DOTALL)
-defre2 = re.compile(ur'===== Definition: =====(.*?)=====', re.UNICODE | re.DOTALL)
-factre = re.compile(ur'===== Facts: =====(.*?)\[See also', re.UNICODE | re.DOTALL)
-factre2 = re.compile(ur'===== Facts: =====(.*?)=====', re.UNICODE | re.DOTALL)
+headingre = re.compile(ur'^[ \t]*(={4,6}) +(.*?) +\1[ \t\r]*$',
+                       re.UNICODE | re.MULTILINE)
 linknamere = re.compile(ur'\|(.*?)\]\]', re.UNICODE)
 linkre = re.compile(ur':([^:]*\|.*?)\]\]', re.UNICODE)
-cfre = re.compile(ur'See also.*', re.UNICODE)
-examplesre = re.compile(ur'===== Examples from the Bible stories.*',
-    re.UNICODE | re.DOTALL)
 extxtre = re.compile(ur'\*\* (.*)', re.UNICODE)
 fridre = re.compile(ur'[0-5][0-9]-[0-9][0-9]', re.UNICODE)
 tNre = re.compile(ur'==== Translation Notes.*', re.UNICODE | re.DOTALL)
@@ -47,120 +60,329 @@ itre = re.compile(ur'==== Important Terms: ====(.*?)====', re.UNICODE | re.DOTAL
 tNtermre = re.compile(ur' \*\*(.*?)\*\* ', re.UNICODE)
 tNtextre = re.compile(ur'\*\* [–-] (.*)', re.UNICODE)
 
-# Regexes for DW to HTML conversion
-boldstartre = re.compile(ur'([ ,.])(\*\*)', re.UNICODE)
-boldstartre2 = re.compile(ur'\*\*', re.UNICODE)
-boldstopre = re.compile(ur'''(\*\*)([ ,.'!])''', re.UNICODE)
+# DW to HTML conversion
+starre = re.compile(ur'\*\*+', re.UNICODE)
 lire = re.compile(ur' +\* ', re.UNICODE)
-h3re = re.compile(ur'\n=== (.*?) ===\n', re.UNICODE)
+# Characters that open bold before ** and close it after **
+boldopen = frozenset(u' ,.')
+boldclose = frozenset(u" ,.'!")
+htmlcache = {}
+maxhtmlcache = 20000
 
 
-def getKT(f):
-    page = codecs.open(f, 'r', encoding='utf-8').read()
+def getKT(page, f, warnings):
+    '''
+    Parses the key term page read from f.  A missing Definition or Examples
+    section, or an example without text, is left out and a message for it
+    is added to warnings.  Raises ValueError if the page has no term
+    heading.
+    '''
+    sections, sub = getKTSections(page)
     kt = {}
     kt['filename'] = f.rsplit('/', 1)[1].replace('.txt', '')
-    kt['term'] = ktre.search(page).group(1).strip()
-    kt['sub'] = getKTSub(page)
-    kt['def_title'], kt['def'] = getKTDef(page)
-    kt['cf'] = getKTCF(page)
-    kt['ex'] = getKTExamples(page)
+    kt['term'] = getKTTerm(sections)
+    kt['sub'] = sub
+    try:
+        kt['def_title'], kt['def'] = getKTDef(sections)
+    except ValueError as e:
+        warnings.append(unicode(e))
+        kt['def_title'], kt['def'] = ('Definition', u'')
+    kt['cf'] = getKTCF(sections)
+    kt['ex'] = getKTExamples(sections, warnings)
     return kt
 
-def getKTDef(page):
-    def_title = 'Definition'
-    defse = defre.search(page)
-    if not defse:
-        defse = defre2.search(page)
-    if not defse:
-        defse = factre.search(page)
-        def_title = 'Facts'
-    if not defse:
-        defse = factre2.search(page)
-        def_title = 'Facts'
-    deftxt = defse.group(1).rstrip()
-    return (def_title, getHTML(deftxt))
-
-def getKTSub(page):
-    sub = u''
-    subse = subre.search(page)
-    if subse:
-        sub = subse.group(1)
-    return sub.strip()
-
-def getKTCF(page):
-    cf = []
-    cfse = cfre.search(page)
-    if cfse:
-        text = cfse.group(0)
-        cf = linknamere.findall(text)
-    return cf
-
-def getKTExamples(page):
+def getKTSections(page):
+    '''
+    Splits a key term page at its ====== and ===== headings in one pass.
+    Returns an ordered dict of heading to section body (the text before the
+    first heading is under u''), and the text of the first ==== subheading
+    between two lines, or u'' if there is none.  The body of a heading that
+    comes again is added to the end of the first one.
+    '''
+    sections = OrderedDict()
+    sub = None
+    heading = u''
+    start = 0
+    for m in headingre.finditer(page):
+        if len(m.group(1)) == 4:
+            if ( sub is None and m.start() > 0 and
+                                            page[m.end():m.end() + 1] == u'\n' ):
+                sub = m.group(2).strip()
+            continue
+        addKTSection(sections, heading, page[start:m.start()])
+        heading = u'{0} {1} {0}'.format(m.group(1), m.group(2).strip())
+        start = m.end()
+    addKTSection(sections, heading, page[start:])
+    return sections, sub or u''
+
+def addKTSection(sections, heading, body):
+    sections[heading] = sections.get(heading, u'') + body
+
+def getKTTerm(sections):
+    for heading in sections:
+        if heading.startswith(u'====== '):
+            return heading[7:-7].strip()
+    raise ValueError(u'no ====== term ====== heading')
+
+def getKTDef(sections):
+    '''
+    Returns the title and HTML of the Definition (or else Facts) section,
+    up to the See also line.
+    '''
+    for def_title in ('Definition', 'Facts'):
+        heading = u'===== {0}: ====='.format(def_title)
+        if heading in sections:
+            deftxt = sections[heading].split(u'[See also', 1)[0].rstrip()
+            return (def_title, getHTML(deftxt))
+    raise ValueError(u'no Definition or Facts section')
+
+def getKTCF(sections):
+    for body in sections.itervalues():
+        start = body.find(u'See also')
+        if start != -1:
+            end = body.find(u'\n', start)
+            if end == -1:
+                end = len(body)
+            return linknamere.findall(body[start:end])
+    return []
+
+def getKTExamples(sections, warnings):
+    text = None
+    for heading, body in sections.iteritems():
+        if heading.startswith(u'===== Examples from the Bible stories'):
+            text = body
+            break
+    if text is None:
+        warnings.append(u'no Examples from the Bible stories section')
+        return []
     examples = []
-    text = examplesre.search(page).group(0)
     for i in text.split('***'):
         ex = {}
         frse = fridre.search(i)
         if not frse:
             continue
         ex['ref'] = frse.group(0)
-        ex['text'] = extxtre.search(i).group(1).strip()
-        ex['text'] = getHTML(ex['text'])
+        extxtse = extxtre.search(i)
+        if not extxtse:
+            warnings.append(u'no text for the example from {0}'.format(
+                                                                   ex['ref']))
+            continue
+        ex['text'] = getHTML(extxtse.group(1).strip())
         examples.append(ex)
     return examples
 
 def getHTML(text):
-    # add ul/li
-    text = boldstartre.sub(ur'\1<b>', text)
-    text = boldstopre.sub(ur'</b>\2', text)
-    text = boldstartre2.sub(ur'<b>', text)
-    text = h3re.sub(ur'<h3>\1</h3>', text)
-    text = getHTMLList(text)
-    return text.strip()
-
-def getHTMLList(text):
+    '''
+    Returns the HTML for a fragment of DokuWiki text.  The same note is
+    often on several frames, so the results are memoized.
+    '''
+    html = htmlcache.get(text)
+    if html is None:
+        html = renderHTML(text)
+        if len(htmlcache) >= maxhtmlcache:
+            htmlcache.clear()
+        htmlcache[text] = html
+    return html
+
+def renderHTML(text):
+    '''
+    Converts bold, level 3 headings and lists to HTML in one pass over the
+    lines.  A heading swallows the newlines around it, so it is joined to
+    the lines before and after it (which matters for lists), and the line
+    after a heading can not be one.  The result has no newlines.
+    '''
+    lines = text.split(u'\n')
+    last = len(lines) - 1
+    merged = []
+    joinnext = False
+    for i, line in enumerate(lines):
+        if u'**' in line:
+            line = getBold(line)
+        if ( not joinnext and 0 < i < last and len(line) > 7 and
+                  line.startswith(u'=== ') and line.endswith(u' ===') ):
+            merged[-1] = u'{0}<h3>{1}</h3>'.format(merged[-1], line[4:-4])
+            joinnext = True
+        elif joinnext:
+            merged[-1] += line
+            joinnext = False
+        else:
+            merged.append(line)
+    html = []
     started = False
-    newtext = []
-    for line in text.split(u'\n'):
-        if lire.search(line):
+    for line in merged:
+        if u'* ' in line and lire.search(line):
             if not started:
                 started = True
-                newtext.append(u'<ul>')
-            line = lire.sub(u'<li>', line)
-            newtext.append(u'{0}</li>'.format(line))
+                html.append(u'<ul>')
+            html.append(lire.sub(u'<li>', line))
+            html.append(u'</li>')
         else:
             if started:
                 started = False
-                newtext.append(u'</ul>')
-            newtext.append(line)
+                html.append(u'</ul>')
+            html.append(line)
     if started:
-        newtext.append(u'</ul>')
-    return u''.join(newtext)
+        html.append(u'</ul>')
+    return u''.join(html).strip()
 
-def writeJSON(outfile, p):
-    f = codecs.open(outfile, 'w', encoding='utf-8')
-    f.write(getDump(p))
-    f.close()
+def getBold(line):
+    '''
+    Converts each run of two or more *s in line.  The first pair opens bold
+    if the run follows a space, comma or period, the last pair of the rest
+    closes it if the run is followed by one of boldclose, and whatever
+    pairs are left open it.
+    '''
+    parts = []
+    pos = 0
+    for m in starre.finditer(line):
+        start, end = m.span()
+        n = end - start
+        opened = start > 0 and line[start - 1] in boldopen
+        if opened:
+            n -= 2
+        closed = n > 1 and end < len(line) and line[end] in boldclose
+        if closed:
+            n -= 2
+        parts.append(line[pos:start])
+        if opened:
+            parts.append(u'<b>')
+        parts.append(u'<b>' * (n // 2) + u'*' * (n % 2))
+        if closed:
+            parts.append(u'</b>')
+        pos = end
+    parts.append(line[pos:])
+    return u''.join(parts)
 
-def getDump(j):
-    return json.dumps(j, indent=2, sort_keys=True)
+def writeJSON(outfile, p, opts=None):
+    makeDir(outfile.rpartition('/')[0])
+    digest, size = json_stream.writeJSON(outfile, p)
+    instrument.count('files_written')
+    instrument.count('bytes_written', size)
+    if opts and opts['minify']:
+        api_artifacts.writeArtifacts(outfile, digest, opts['brotli'])
 
-def getFrame(f):
-    page = codecs.open(f, 'r', encoding='utf-8').read()
-    getAliases(page)
+def writeFileAtomic(outfile, p):
+    '''
+    Writes p with fileutil.writeFileAtomic and counts it.
+    '''
+    fileutil.writeFileAtomic(outfile, p)
+    instrument.count('files_written')
+    instrument.countBytes('bytes_written', p)
+
+def parseFrame(page, f):
+    '''
+    Parses the tN frame page read from f.  Returns the frame and the
+    [key term page, name] of each link in its Important Terms.
+    '''
     frame = {}
     frame['id'] = fridre.search(f).group(0).strip()
     frame['tn'] = gettN(page)
-    return frame
+    return { 'frame': frame,
+             'links': getLinks(page),
+           }
+
+def parseKT(page, f):
+    '''
+    Parses the key term page read from f.  A page that cannot be parsed is
+    recorded with the error, and one that can with its warnings, so that
+    they are reported without the page being parsed again.
+    '''
+    warnings = []
+    try:
+        kt = getKT(page, f, warnings)
+    except ValueError as e:
+        return { 'error': unicode(e) }
+    return { 'kt': kt,
+             'warnings': warnings,
+           }
 
-def getAliases(page):
+def getLinks(page):
     text = itre.search(page).group(1).strip()
-    its = linkre.findall(text)
-    for t in its:
-        term, alias = t.split('|')
-        if not ktaliases.has_key(term):
-            ktaliases[term] = []
-        ktaliases[term].append(alias)
+    return [t.split('|') for t in linkre.findall(text)]
+
+def getAliases(links, aliases):
+    '''
+    Adds the key term links of a tN frame to aliases, a dict of key term
+    page name to the names it is linked with.  Returns the key term page
+    names linked from the frame.
+    '''
+    terms = []
+    for t in links:
+        term, alias = t
+        if not aliases.has_key(term):
+            aliases[term] = []
+        aliases[term].append(alias)
+        if term not in terms:
+            terms.append(term)
+    return terms
+
+def getParsedCached(f, parser, manifest, newmanifest):
+    '''
+    Returns parser(page, f) from the manifest if f is unchanged, otherwise
+    parses it.  A size and mtime match skips reading the file, a digest
+    match skips parsing it.  The entry is recorded in newmanifest.
+    '''
+    name = os.path.basename(f)
+    st = os.stat(f)
+    entry = manifest.get(name)
+    if ( entry and entry['size'] == st.st_size and
+                                            entry['mtime'] == st.st_mtime ):
+        newmanifest[name] = entry
+        instrument.count('notes_cached')
+        return entry['parsed']
+    raw = open(f, 'rb').read()
+    instrument.count('files_read')
+    digest = hashlib.sha1(raw).hexdigest()
+    if entry and entry['digest'] == digest:
+        parsed = entry['parsed']
+    else:
+        parsed = parser(raw.decode('utf-8'), f)
+    newmanifest[name] = { 'size': st.st_size,
+                          'mtime': st.st_mtime,
+                          'digest': digest,
+                          'parsed': parsed,
+                        }
+    return parsed
+
+def getDigests(files):
+    return dict([(k, v['digest']) for k, v in files.iteritems()])
+
+def getManifestPath(lang, kind):
+    return os.path.join(cachedir, lang, '{0}-manifest.json'.format(kind))
+
+def loadManifest(lang, kind, opts=None):
+    '''
+    Returns the tn or kt manifest for lang, or an empty one if opts asks
+    for a full export or the manifest was written by an older version.
+    '''
+    path = getManifestPath(lang, kind)
+    if ( opts and opts.get('full') ) or not os.path.isfile(path):
+        return {}
+    manifest = json.load(codecs.open(path, 'r', encoding='utf-8'))
+    if manifest.get('version') != manifestversion:
+        return {}
+    return manifest
+
+def saveManifest(lang, kind, manifest, oldmanifest=None):
+    '''
+    Writes manifest for lang unless it is the same as oldmanifest, the one
+    it was loaded as.
+    '''
+    manifest['version'] = manifestversion
+    if manifest == oldmanifest:
+        return
+    writeFileAtomic(getManifestPath(lang, kind), json.dumps(manifest))
+
+def isUnchanged(manifest, newmanifest, outfiles):
+    '''
+    Returns True if the inputs recorded in newmanifest have the same digests
+    as in manifest and all of outfiles exist, i.e. nothing needs writing.
+    '''
+    if not manifest or manifest.get('inputs') != newmanifest.get('inputs'):
+        return False
+    if getDigests(manifest['files']) != getDigests(newmanifest['files']):
+        return False
+    return all([os.path.isfile(x) for x in outfiles])
 
 def gettN(page):
     tN = []
@@ -176,16 +398,54 @@ def gettN(page):
         tN.append(item)
     return tN
 
-def runKT(lang, today):
+def runKT(lang, today, opts=None, aliases=None, refs=None):
+    '''
+    Exports the key terms for lang, with the aliases and frame references
+    collected by runtN.  The references are written to kt-{lang}.refs.json
+    (see getRefs).  If lang has an obs-{lang}.json, the frames the terms
+    occur in are indexed to kt-{lang}.matches.json as well (see
+    kt_matcher.py).  Nothing is written if neither the key term pages nor
+    the aliases, references or obs-{lang}.json changed since the last run.
+    '''
+    if aliases is None:
+        aliases = {}
+    if refs is None:
+        refs = {}
     ktpath = os.path.join(pages, lang, 'obs/notes/key-terms')
     apipath = os.path.join(api, lang)
+    ktfile = '{0}/kt-{1}.json'.format(apipath, lang)
+    reffile = '{0}/kt-{1}.refs.json'.format(apipath, lang)
+    matchfile = '{0}/kt-{1}.matches.json'.format(apipath, lang)
+    obspath = '{0}/obs-{1}.json'.format(apipath, lang)
+    manifest = loadManifest(lang, 'kt', opts)
+    newmanifest = { 'files': {},
+                    'inputs': getKTInputsDigest(aliases, refs, obspath),
+                  }
     keyterms = []
-    for f in glob.glob('{0}/*.txt'.format(ktpath)):
-        if 'home.txt' in f or '1-discussion-topic.txt' in f: continue
-        keyterms.append(getKT(f))
+    with instrument.span('kt_parse', lang):
+        for f in glob.glob('{0}/*.txt'.format(ktpath)):
+            if 'home.txt' in f or '1-discussion-topic.txt' in f: continue
+            parsed = getParsedCached(f, parseKT, manifest.get('files', {}),
+                                                       newmanifest['files'])
+            if 'error' in parsed:
+                print u'ERROR: skipping key term {0}: {1}'.format(f,
+                                                              parsed['error'])
+                continue
+            for w in parsed['warnings']:
+                print u'WARNING: key term {0}: {1}'.format(f, w)
+            keyterms.append(dict(parsed['kt']))
+    outfiles = [ktfile, reffile]
+    if os.path.isfile(obspath):
+        outfiles.append(matchfile)
+    if isUnchanged(manifest, newmanifest, outfiles):
+        # the pages may still have been touched, so keep their new mtimes
+        saveManifest(lang, 'kt', newmanifest, manifest)
+        return
+    names = {}
     for i in keyterms:
+        names[i['filename']] = i['term']
         try:
-            i['aliases'] = list(set([x for x in ktaliases[i['filename']]
+            i['aliases'] = list(set([x for x in aliases[i['filename']]
                                                           if x != i['term']]))
         except KeyError:
             # this just means no aliases were found
@@ -193,21 +453,185 @@ def runKT(lang, today):
         del i['filename']
     keyterms.sort(key=lambda x: len(x['term']), reverse=True)
     keyterms.append({'date_modified': today})
-    writeJSON('{0}/kt-{1}.json'.format(apipath, lang), keyterms)
+    with instrument.span('kt_write', lang):
+        writeJSON(ktfile, keyterms, opts)
+        writeJSON(reffile, getRefs(refs, names, today), opts)
+    if os.path.isfile(obspath):
+        with instrument.span('kt_match', lang):
+            jsonlang = json.load(codecs.open(obspath, 'r', encoding='utf-8'))
+            instrument.count('files_read')
+            index = kt_matcher.getIndex(keyterms, jsonlang, today)
+            writeJSON(matchfile, index, opts)
+    saveManifest(lang, 'kt', newmanifest)
 
-def runtN(lang, today):
+def getKTInputsDigest(aliases, refs, obspath):
+    '''
+    Returns the SHA-1 of what the key term files depend on besides the key
+    term pages: the aliases and references from the tN frames and the
+    obs-{lang}.json at obspath.
+    '''
+    obsdigest = None
+    if os.path.isfile(obspath):
+        obsdigest = hashlib.sha1(open(obspath, 'rb').read()).hexdigest()
+    canon = [ dict([(k, sorted(set(v))) for k, v in aliases.iteritems()]),
+              refs,
+              obsdigest ]
+    return hashlib.sha1(json.dumps(canon, sort_keys=True)).hexdigest()
+
+def getRefs(refs, names, today):
+    '''
+    Returns the index of which frames link to which key terms, both ways:
+
+        { "date_modified": "20141018",
+          "frames": { "01-02": [ "God", ... ], ... },
+          "terms": { "God": [ "01-02", ... ], ... } }
+
+    refs maps frame ids to the key term pages they link and names maps the
+    pages to their terms.  Links to pages that are not key terms are left
+    out.
+    '''
+    frames = {}
+    terms = {}
+    for frid, pages in refs.iteritems():
+        linked = sorted(set([names[x] for x in pages if x in names]))
+        if not linked:
+            continue
+        frames[frid] = linked
+        for term in linked:
+            terms.setdefault(term, []).append(frid)
+    for frids in terms.itervalues():
+        frids.sort()
+    return { 'date_modified': today,
+             'frames': frames,
+             'terms': terms,
+           }
+
+def runtN(lang, today, opts=None, aliases=None, refs=None):
+    '''
+    Exports the tN frames for lang.  The key term aliases found in them are
+    added to aliases and the key terms each frame links to refs, if they
+    are given.  Frames whose pages have not changed since the last run come
+    from the manifest, and tN-{lang}.json is only written if one did.
+    '''
+    if aliases is None:
+        aliases = {}
     tNpath = os.path.join(pages, lang, 'obs/notes/frames')
     apipath = os.path.join(api, lang)
+    tNfile = '{0}/tN-{1}.json'.format(apipath, lang)
+    manifest = loadManifest(lang, 'tn', opts)
+    newmanifest = { 'files': {} }
     frames = []
-    for f in glob.glob('{0}/*.txt'.format(tNpath)):
-        if 'home.txt' in f: continue
-        frames.append(getFrame(f))
+    with instrument.span('tn_parse', lang):
+        for f in glob.glob('{0}/*.txt'.format(tNpath)):
+            if 'home.txt' in f: continue
+            parsed = getParsedCached(f, parseFrame, manifest.get('files', {}),
+                                                       newmanifest['files'])
+            terms = getAliases(parsed['links'], aliases)
+            if refs is not None:
+                refs[parsed['frame']['id']] = terms
+            frames.append(parsed['frame'])
+    if isUnchanged(manifest, newmanifest, [tNfile]):
+        saveManifest(lang, 'tn', newmanifest, manifest)
+        return
     frames.sort(key=lambda x: x['id'])
     frames.append({'date_modified': today})
-    writeJSON('{0}/tN-{1}.json'.format(apipath, lang), frames)
+    with instrument.span('tn_write', lang):
+        writeJSON(tNfile, frames, opts)
+    saveManifest(lang, 'tn', newmanifest)
+
+def getLangs(pagesdir):
+    '''
+    Returns the languages in pagesdir with tN frames or key terms.
+    '''
+    langs = []
+    for lang in sorted(os.listdir(pagesdir)):
+        if lang in ['playground', 'template']:
+            continue
+        notesdir = os.path.join(pagesdir, lang, 'obs/notes')
+        if ( os.path.isdir(os.path.join(notesdir, 'frames')) or
+                         os.path.isdir(os.path.join(notesdir, 'key-terms')) ):
+            langs.append(lang)
+    return langs
+
+def exportLang(lang, today, opts=None):
+    '''
+    Exports the tN frames and then the key terms for lang, each only if the
+    language has them.  The key term aliases and the frames linking to each
+    term come from the tN frames, so they are collected in tables of the
+    language's own.
+    '''
+    aliases = {}
+    refs = {}
+    notesdir = os.path.join(pages, lang, 'obs/notes')
+    if os.path.isdir(os.path.join(notesdir, 'frames')):
+        runtN(lang, today, opts, aliases, refs)
+    if os.path.isdir(os.path.join(notesdir, 'key-terms')):
+        runKT(lang, today, opts, aliases, refs)
+
+def exportLangWorker(args):
+    '''
+    Runs exportLang in a pool worker and hands back the instrumentation
+    records.
+    '''
+    with instrument.span('language', args[0]):
+        exportLang(*args)
+    return instrument.collect()
+
+def mapLangs(func, arglist, jobs):
+    '''
+    Runs func over arglist, in a pool of jobs worker processes if jobs is
+    more than one.  Results are returned in the same order as arglist.
+    '''
+    if jobs < 2 or len(arglist) < 2:
+        return [func(x) for x in arglist]
+    pool = multiprocessing.Pool(min(jobs, len(arglist)), instrument.reset)
+    try:
+        return pool.map(func, arglist, 1)
+    finally:
+        pool.close()
+        pool.join()
+
+def runExport(langs, today, opts=None, jobs=1):
+    '''
+    Exports tN and key terms for each of langs, in jobs worker processes.
+    '''
+    arglist = [(x, today, opts) for x in langs]
+    for metrics in mapLangs(exportLangWorker, arglist, jobs):
+        instrument.merge(metrics)
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-l', '--language', dest="langs", action='append',
+        default=None, help="Language to export, may be given more than once "
+                           "(default: every language with notes)")
+    parser.add_argument('-j', '--jobs', dest="jobs", type=int, default=1,
+        help="Number of worker processes to export languages with")
+    parser.add_argument('--full', dest="full", action='store_true',
+        default=False, help="Ignore the manifests, reparse and rewrite all")
+    parser.add_argument('--minify', dest="minify", action='store_true',
+        default=False, help="Also write minified and gzipped JSON")
+    parser.add_argument('--brotli', dest="brotli", action='store_true',
+        default=False, help="With --minify, also write brotli files")
+    parser.add_argument('--metrics', dest="metrics", default=None,
+        help="Write timings and counters to this file (.prom for the "
+             "Prometheus textfile format, JSON otherwise)")
+    args = parser.parse_args(sys.argv[1:])
+    if args.brotli and not api_artifacts.hasBrotli():
+        print "Please install brotli with pip"
+        sys.exit(1)
+    if args.metrics:
+        instrument.enable('json_tn_export')
+    opts = { 'minify': args.minify,
+             'brotli': args.brotli,
+             'full': args.full,
+           }
     today = ''.join(str(datetime.date.today()).rsplit('-')[0:3])
-    runtN('en', today)
-    runKT('en', today)
+    langs = args.langs
+    if not langs:
+        langs = getLangs(pages)
+    with instrument.span('total'):
+        runExport(langs, today, opts, args.jobs)
+    if args.metrics:
+        instrument.writeSummary(args.metrics)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#  Copyright (c) 2014 unfoldingWord
+#  http://creativecommons.org/licenses/MIT/
+#  See LICENSE file for details.
+#
+#  Contributors:
+#  Jesse Griffin <jesse@distantshores.org>
+#
+
+'''
+Finds the key terms (and their aliases) in the frames of an OBS language.
+
+An Aho-Corasick automaton is built from every term, each comma separated
+name in it and its aliases, so each frame is scanned once whatever the
+number of terms.  Matching ignores case and only whole words count.  Where
+matches overlap the leftmost, then longest, one wins.  The index looks like
+
+    { "date_modified": "20141018",
+      "frames": { "01-02": [ [offset, length, "God"], ... ], ... } }
+
+with offsets and lengths in UTF-16 code units, as JavaScript and Java
+count them.  json_tn_export.py writes it next to kt-{lang}.json as
+kt-{lang}.matches.json.
+'''
+
+import os
+import re
+import sys
+import argparse
+import unicodedata
+from fileutil import getDump, loadJSON, writeFileAtomic
+
+api = '/var/www/vhosts/api.unfoldingword.org/httpdocs/obs/txt/1/'
+astralre = re.compile(u'[^\u0000-\uffff]', re.UNICODE)
+
+
+def fold(text):
+    '''
+    Lower cases text one character at a time, so offsets stay the same.
+    '''
+    folded = text.lower()
+    if len(folded) == len(text):
+        return folded
+    return u''.join([x.lower() if len(x.lower()) == 1 else x for x in text])
+
+def getPatterns(keyterms):
+    '''
+    Returns a dict of folded pattern to the term it finds.  A pattern shared
+    by several terms goes to the first of them.
+    '''
+    patterns = {}
+    for kt in keyterms:
+        if 'term' not in kt:
+            continue
+        names = [kt['term']]
+        names.extend([x.strip() for x in kt['term'].split(u',')])
+        names.extend(kt.get('aliases', []))
+        for name in names:
+            name = fold(name.strip())
+            if name and name not in patterns:
+                patterns[name] = kt['term']
+    return patterns
+
+def buildAutomaton(patterns):
+    '''
+    Builds the automaton for a dict of pattern to term.  States are list
+    indexes: goto holds each state's transitions, fail its failure link and
+    out the (length, term) of every pattern ending there.
+    '''
+    goto = [{}]
+    fail = [0]
+    out = [[]]
+    for pattern, term in patterns.iteritems():
+        s = 0
+        for c in pattern:
+            if c not in goto[s]:
+                goto.append({})
+                fail.append(0)
+                out.append([])
+                goto[s][c] = len(goto) - 1
+            s = goto[s][c]
+        out[s].append((len(pattern), term))
+    queue = goto[0].values()
+    while queue:
+        nextqueue = []
+        for s in queue:
+            for c, t in goto[s].iteritems():
+                f = fail[s]
+                while f and c not in goto[f]:
+                    f = fail[f]
+                if s:
+                    fail[t] = goto[f].get(c, 0)
+                out[t] = out[t] + out[fail[t]]
+                nextqueue.append(t)
+        queue = nextqueue
+    return { 'goto': goto,
+             'fail': fail,
+             'out': out,
+           }
+
+def isWordChar(c):
+    return c.isalnum() or unicodedata.category(c)[0] == 'M'
+
+def findAll(automaton, text):
+    '''
+    Returns every (offset, length, term) whole word match in text.
+    '''
+    goto = automaton['goto']
+    fail = automaton['fail']
+    out = automaton['out']
+    matches = []
+    s = 0
+    folded = fold(text)
+    end = len(text)
+    for i, c in enumerate(folded):
+        while s and c not in goto[s]:
+            s = fail[s]
+        s = goto[s].get(c, 0)
+        for length, term in out[s]:
+            start = i - length + 1
+            if start > 0 and isWordChar(text[start - 1]):
+                continue
+            if i + 1 < end and isWordChar(text[i + 1]):
+                continue
+            matches.append((start, length, term))
+    return matches
+
+def getMatches(automaton, text):
+    '''
+    Returns the leftmost longest matches in text which do not overlap, as
+    [offset, length, term] lists.
+    '''
+    matches = []
+    pos = 0
+    for start, length, term in sorted(findAll(automaton, text),
+                                       key=lambda x: (x[0], -x[1])):
+        if start < pos:
+            continue
+        matches.append([start, length, term])
+        pos = start + length
+    if matches and sys.maxunicode > 0xffff and astralre.search(text):
+        matches = [getUTF16Match(text, x) for x in matches]
+    return matches
+
+def getUTF16Match(text, match):
+    start, length, term = match
+    before = len(astralre.findall(text[:start]))
+    inside = len(astralre.findall(text[start:start + length]))
+    return [start + before, length + inside, term]
+
+def getIndex(keyterms, jsonlang, today):
+    '''
+    Returns the frame to key term match index for a language document.
+    '''
+    automaton = buildAutomaton(getPatterns(keyterms))
+    frames = {}
+    for c in jsonlang['chapters']:
+        for f in c['frames']:
+            matches = getMatches(automaton, f['text'])
+            if matches:
+                frames[f['id']] = matches
+    return { 'date_modified': today,
+             'frames': frames,
+           }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-l', '--language', dest="lang", required=True,
+        help="Language code")
+    parser.add_argument('-a', '--api', dest="api", default=api,
+        help="API directory with the <lang>/kt-<lang>.json and "
+             "<lang>/obs-<lang>.json files")
+    args = parser.parse_args(sys.argv[1:])
+    langdir = os.path.join(args.api, args.lang)
+    keyterms = loadJSON(os.path.join(langdir, 'kt-{0}.json'.format(
+                                                               args.lang)), 'l')
+    jsonlang = loadJSON(os.path.join(langdir, 'obs-{0}.json'.format(
+                                                               args.lang)), 'd')
+    if not keyterms or not jsonlang:
+        print 'Need both kt-{0}.json and obs-{0}.json in {1}'.format(
+                                                            args.lang, langdir)
+        sys.exit(1)
+    index = getIndex(keyterms, jsonlang, keyterms[-1].get('date_modified'))
+    writeFileAtomic(os.path.join(langdir, 'kt-{0}.matches.json'.format(
+                                                   args.lang)), getDump(index))
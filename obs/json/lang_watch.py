@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#  Copyright (c) 2014 unfoldingWord
+#  http://creativecommons.org/licenses/MIT/
+#  See LICENSE file for details.
+#
+#  Contributors:
+#  Jesse Griffin <jesse@distantshores.org>
+#
+#  watch() requires pyinotify.
+
+'''
+Watches the Door43 pages for OBS edits and reports which languages changed.
+
+Only <top>/<lang>/obs directories are watched, for each of the given tops
+(the pages directory and the uwadmin directory).  New language and obs
+directories are picked up as they appear.  A language is handed to the
+callback once no event has been seen for it for delay seconds, or at the
+latest maxdelay seconds after its first event, so that a burst of writes
+(a git pull, a DokuWiki save) gives a single export.
+'''
+
+import os
+import re
+import sys
+import time
+import traceback
+from functools import partial
+
+# Files under <lang>/obs/ that go into the language document
+obsfilere = re.compile(r'^([0-5][0-9]|app_words|status)\.txt$')
+
+
+def isExcluded(top, path):
+    '''
+    Returns True unless path is top, top/<lang> or top/<lang>/obs.
+    '''
+    rel = os.path.relpath(path, top)
+    if rel == '.':
+        return False
+    parts = rel.split(os.sep)
+    return len(parts) > 2 or ( len(parts) == 2 and parts[1] != 'obs' )
+
+def getEventLang(tops, path):
+    '''
+    Returns the language an event on path belongs to, or None if it does
+    not affect a language document.
+    '''
+    for top in tops:
+        rel = os.path.relpath(path, top)
+        if rel.startswith('..'):
+            continue
+        parts = rel.split(os.sep)
+        if len(parts) == 2 and parts[1] == 'obs':
+            return parts[0]
+        if ( len(parts) == 3 and parts[1] == 'obs' and
+                                               obsfilere.match(parts[2]) ):
+            return parts[0]
+    return None
+
+def addEvent(pending, lang, now):
+    '''
+    Records an event for lang at time now in pending, a dict of language
+    to the times of its first and last event.
+    '''
+    if lang in pending:
+        pending[lang][1] = now
+    else:
+        pending[lang] = [now, now]
+
+def popReady(pending, now, delay, maxdelay):
+    '''
+    Removes and returns the languages in pending which have been quiet for
+    delay seconds or waiting for maxdelay seconds.
+    '''
+    ready = [x for x, (first, last) in pending.iteritems()
+                       if now - last >= delay or now - first >= maxdelay]
+    for lang in ready:
+        del pending[lang]
+    return sorted(ready)
+
+def onEvent(tops, pending, event):
+    lang = getEventLang(tops, event.pathname)
+    if lang is not None:
+        addEvent(pending, lang, time.time())
+
+def addWatches(wm, top, mask):
+    '''
+    Watches top, each language directory in it and each obs directory.
+    '''
+    exclude = partial(isExcluded, top)
+    dirs = [top]
+    for lang in os.listdir(top):
+        langdir = os.path.join(top, lang)
+        if not os.path.isdir(langdir):
+            continue
+        dirs.append(langdir)
+        if os.path.isdir(os.path.join(langdir, 'obs')):
+            dirs.append(os.path.join(langdir, 'obs'))
+    for d in dirs:
+        wm.add_watch(d, mask, auto_add=True, exclude_filter=exclude)
+    return len(dirs)
+
+def watch(tops, callback, delay=2.0, maxdelay=30.0):
+    '''
+    Calls callback with the list of changed languages after each burst of
+    writes, until interrupted.  An exception raised by the callback is
+    printed and the watch carries on.
+    '''
+    try:
+        import pyinotify
+    except ImportError:
+        print "Please install pyinotify with pip"
+        sys.exit(1)
+    tops = [os.path.abspath(x) for x in tops if os.path.isdir(x)]
+    mask = ( pyinotify.IN_CLOSE_WRITE | pyinotify.IN_CREATE |
+             pyinotify.IN_DELETE | pyinotify.IN_MOVED_TO |
+             pyinotify.IN_MOVED_FROM )
+    pending = {}
+    wm = pyinotify.WatchManager()
+    notifier = pyinotify.Notifier(wm, partial(onEvent, tops, pending))
+    watched = 0
+    for top in tops:
+        watched += addWatches(wm, top, mask)
+    print 'Watching {0} directories under {1}'.format(watched,
+                                                          ', '.join(tops))
+    try:
+        while True:
+            timeout = None
+            if pending:
+                timeout = int(delay * 1000)
+            if notifier.check_events(timeout):
+                notifier.read_events()
+                notifier.process_events()
+            langs = popReady(pending, time.time(), delay, maxdelay)
+            if not langs:
+                continue
+            try:
+                callback(langs)
+            except Exception:
+                traceback.print_exc()
+    finally:
+        notifier.stop()
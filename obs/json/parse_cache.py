@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#  Copyright (c) 2014 unfoldingWord
+#  http://creativecommons.org/licenses/MIT/
+#  See LICENSE file for details.
+#
+#  Contributors:
+#  Jesse Griffin <jesse@distantshores.org>
+#
+
+'''
+Persistent cache of parsed key/value files (langnames.txt, app_words.txt,
+status.txt).
+
+Each file is parsed once and the result kept along with the size and mtime
+of the file, until either changes.  All the entries live in one marshal file
+which is read the first time it is needed and written back with save().
+
+Worker processes hand the entries they added back with collect(), and the
+parent adds them with merge() before saving.
+'''
+
+import os
+import marshal
+from fileutil import getTmpPath, makeDir
+
+cacheversion = 1
+cachepath = None
+entries = None
+added = {}
+
+
+def setPath(path):
+    '''
+    Sets the cache file to use, dropping anything loaded from another one.
+    '''
+    global cachepath, entries
+    if path != cachepath:
+        cachepath = path
+        entries = None
+
+def getEntries():
+    global entries
+    if entries is None:
+        entries = {}
+        if cachepath and os.path.isfile(cachepath):
+            try:
+                cache = marshal.load(open(cachepath, 'rb'))
+                if cache.get('version') == cacheversion:
+                    entries = cache['entries']
+            except (EOFError, ValueError, TypeError):
+                pass
+    return entries
+
+def getParsed(path, kind, parser):
+    '''
+    Returns parser(path) from the cache if the file has not changed since it
+    was parsed.  Kind names the parser so that one file is never handed to
+    a caller expecting a different one's result.  The parser must return a
+    dict, and the caller gets a copy it is free to change.
+    '''
+    st = os.stat(path)
+    entry = getEntries().get(path)
+    if not ( entry and entry[0] == kind and entry[1] == st.st_size and
+                                                   entry[2] == st.st_mtime ):
+        entry = (kind, st.st_size, st.st_mtime, parser(path))
+        entries[path] = entry
+        added[path] = entry
+    return dict(entry[3])
+
+def collect():
+    '''
+    Returns the entries added in this process and forgets them.
+    '''
+    recs = dict(added)
+    added.clear()
+    return recs
+
+def merge(recs):
+    getEntries().update(recs)
+    added.update(recs)
+
+def reset():
+    '''
+    Forgets the added entries, e.g. in a worker process forked after some
+    were added.
+    '''
+    added.clear()
+
+def save():
+    '''
+    Writes the cache back if anything was added, dropping entries for files
+    that no longer exist.
+    '''
+    if not cachepath or not added:
+        return False
+    for path in [x for x in entries if not os.path.exists(x)]:
+        del entries[path]
+    makeDir(os.path.dirname(cachepath))
+    tmpfile = getTmpPath(cachepath)
+    f = open(tmpfile, 'wb')
+    marshal.dump({ 'version': cacheversion,
+                   'entries': entries,
+                 }, f)
+    f.close()
+    os.rename(tmpfile, cachepath)
+    added.clear()
+    return True
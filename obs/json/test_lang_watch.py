@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#  Copyright (c) 2014 unfoldingWord
+#  http://creativecommons.org/licenses/MIT/
+#  See LICENSE file for details.
+#
+#  Contributors:
+#  Jesse Griffin <jesse@distantshores.org>
+#
+
+'''
+Tests for lang_watch.py.  They do not need pyinotify:
+
+    python -m unittest test_lang_watch
+'''
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+# Make sure nothing below reaches for pyinotify
+sys.modules.setdefault('pyinotify', None)
+import lang_watch
+
+
+class FakeWatchManager:
+
+    def __init__(self):
+        self.watches = []
+
+    def add_watch(self, path, mask, auto_add=False, exclude_filter=None):
+        self.watches.append((path, exclude_filter))
+
+
+class LangWatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.pages = os.path.join(self.tmpdir, 'pages')
+        self.uwadmin = os.path.join(self.pages, 'en', 'uwadmin')
+        for d in ( os.path.join(self.pages, 'en', 'obs'),
+                   os.path.join(self.pages, 'fr', 'obs'),
+                   os.path.join(self.pages, 'de', 'notes'),
+                   os.path.join(self.uwadmin, 'fr', 'obs') ):
+            os.makedirs(d)
+        open(os.path.join(self.pages, 'readme.txt'), 'w').close()
+        self.tops = [self.pages, self.uwadmin]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def getLang(self, *parts):
+        return lang_watch.getEventLang(self.tops,
+                                       os.path.join(self.tmpdir, *parts))
+
+    def test_page_langs(self):
+        self.assertEqual(self.getLang('pages', 'en', 'obs', '01.txt'), 'en')
+        self.assertEqual(self.getLang('pages', 'fr', 'obs', '50.txt'), 'fr')
+        self.assertEqual(self.getLang('pages', 'fr', 'obs', 'app_words.txt'),
+                                                                        'fr')
+        self.assertEqual(self.getLang('pages', 'fr', 'obs', 'status.txt'),
+                                                                        'fr')
+        self.assertEqual(self.getLang('pages', 'fr', 'obs'), 'fr')
+
+    def test_uwadmin_status(self):
+        self.assertEqual(self.getLang('pages', 'en', 'uwadmin', 'fr', 'obs',
+                                                         'status.txt'), 'fr')
+
+    def test_other_paths(self):
+        self.assertEqual(self.getLang('pages', 'en', 'obs', 'sidebar.txt'),
+                                                                        None)
+        self.assertEqual(self.getLang('pages', 'en', 'obs', '01.txt.bak'),
+                                                                        None)
+        self.assertEqual(self.getLang('pages', 'en', 'obs', 'notes',
+                                                          '01-01.txt'), None)
+        self.assertEqual(self.getLang('pages', 'de', 'notes', '01.txt'),
+                                                                        None)
+        self.assertEqual(self.getLang('pages', 'readme.txt'), None)
+        self.assertEqual(self.getLang('media', 'en', 'obs', '01.txt'), None)
+
+    def test_excluded(self):
+        top = self.pages
+        self.assertFalse(lang_watch.isExcluded(top, top))
+        self.assertFalse(lang_watch.isExcluded(top, os.path.join(top, 'en')))
+        self.assertFalse(lang_watch.isExcluded(top, os.path.join(top, 'en',
+                                                                     'obs')))
+        self.assertTrue(lang_watch.isExcluded(top, os.path.join(top, 'de',
+                                                                   'notes')))
+        self.assertTrue(lang_watch.isExcluded(top, os.path.join(top, 'en',
+                                                       'obs', 'notes')))
+
+    def test_add_watches(self):
+        wm = FakeWatchManager()
+        watched = lang_watch.addWatches(wm, self.pages, 0)
+        paths = sorted([x[0] for x in wm.watches])
+        self.assertEqual(watched, len(paths))
+        self.assertEqual(paths, sorted([ self.pages,
+                                 os.path.join(self.pages, 'de'),
+                                 os.path.join(self.pages, 'en'),
+                                 os.path.join(self.pages, 'en', 'obs'),
+                                 os.path.join(self.pages, 'fr'),
+                                 os.path.join(self.pages, 'fr', 'obs') ]))
+
+    def test_burst_held_until_quiet(self):
+        pending = {}
+        for now in (0.0, 0.5, 1.0, 1.5):
+            lang_watch.addEvent(pending, 'en', now)
+            self.assertEqual(lang_watch.popReady(pending, now, 2.0, 30.0),
+                                                                          [])
+        lang_watch.addEvent(pending, 'fr', 2.0)
+        self.assertEqual(lang_watch.popReady(pending, 3.4, 2.0, 30.0), [])
+        self.assertEqual(lang_watch.popReady(pending, 3.5, 2.0, 30.0),
+                                                                      ['en'])
+        self.assertEqual(lang_watch.popReady(pending, 4.0, 2.0, 30.0),
+                                                                      ['fr'])
+        self.assertEqual(pending, {})
+
+    def test_flush_at_maxdelay(self):
+        pending = {}
+        now = 0.0
+        while now < 30.0:
+            lang_watch.addEvent(pending, 'en', now)
+            self.assertEqual(lang_watch.popReady(pending, now, 2.0, 30.0),
+                                                                          [])
+            now += 1.0
+        lang_watch.addEvent(pending, 'en', now)
+        self.assertEqual(lang_watch.popReady(pending, now, 2.0, 30.0),
+                                                                      ['en'])
+        self.assertEqual(pending, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+#
+#  Copyright (c) 2014 unfoldingWord
+#  http://creativecommons.org/licenses/MIT/
+#  See LICENSE file for details.
+#
+#  Contributors:
+#  Jesse Griffin <jesse@distantshores.org>
+#
+
+'''
+Keeps versions of OBS JSON exports with each frame text stored only once.
+
+A frame's text is stored once under the SHA-1 of its UTF-8 bytes, and a
+version is a manifest in <store>/versions/<name>.json: the export with
+every frame's text replaced by its hash (and its number of words, which
+comparer.py needs for unchanged frames).  Comparing two versions reads
+their manifests and the text index, but only the texts whose hashes differ
+(see comparer.py --store).
+
+The texts are appended to <store>/texts.pack, and texts.idx.json maps each
+hash to its offset and length there, so that a few hundred bytes of text do
+not each take a file (and a disk block) of their own.  The index is written
+after the texts, so a run that dies half way leaves at worst some unused
+bytes at the end of the pack.
+
+The store is given with --store and should be kept outside this checkout.
+
+    ./version_store.py -s /var/tmp/obs-versions --add obs-ver_1.json
+    ./version_store.py -s /var/tmp/obs-versions --list
+    ./version_store.py -s /var/tmp/obs-versions --export ver_1 -o obs-ver_1.json
+'''
+
+import os
+import sys
+import json
+import codecs
+import hashlib
+import argparse
+from fileutil import getDump, writeFileAtomic, makeDir
+
+indexes = {}
+
+
+def getDigest(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def getPackPath(storedir):
+    return os.path.join(storedir, 'texts.pack')
+
+def getIndexPath(storedir):
+    return os.path.join(storedir, 'texts.idx.json')
+
+def getManifestPath(storedir, name):
+    return os.path.join(storedir, 'versions', '{0}.json'.format(name))
+
+def getIndex(storedir):
+    '''
+    Returns the hash to [offset, length] index of the texts in storedir,
+    read once per process.
+    '''
+    if storedir not in indexes:
+        index = {}
+        if os.path.isfile(getIndexPath(storedir)):
+            index = json.load(open(getIndexPath(storedir), 'r'))
+        indexes[storedir] = index
+    return indexes[storedir]
+
+def putTexts(storedir, texts):
+    '''
+    Appends those of texts that are not in the store yet to the pack and
+    then writes the index.  Returns the hash of each text.
+    '''
+    index = getIndex(storedir)
+    digests = []
+    new = False
+    makeDir(storedir)
+    f = open(getPackPath(storedir), 'ab')
+    try:
+        for text in texts:
+            digest = getDigest(text)
+            digests.append(digest)
+            if digest in index:
+                continue
+            data = text.encode('utf-8')
+            f.seek(0, os.SEEK_END)
+            index[digest] = [f.tell(), len(data)]
+            f.write(data)
+            new = True
+    finally:
+        f.close()
+    if new:
+        writeFileAtomic(getIndexPath(storedir), json.dumps(index,
+                                                           sort_keys=True))
+    return digests
+
+def getText(storedir, digest):
+    offset, length = getIndex(storedir)[digest]
+    f = open(getPackPath(storedir), 'rb')
+    try:
+        f.seek(offset)
+        return f.read(length).decode('utf-8')
+    finally:
+        f.close()
+
+def addVersion(storedir, name, jsonlang):
+    '''
+    Stores the frame texts of jsonlang and writes its manifest as name,
+    replacing any version of that name.  Returns the manifest.
+    '''
+    digests = iter(putTexts(storedir, [fr['text']
+                      for c in jsonlang['chapters'] for fr in c['frames']]))
+    manifest = dict(jsonlang)
+    manifest['chapters'] = []
+    for c in jsonlang['chapters']:
+        chapter = dict(c)
+        chapter['frames'] = []
+        for fr in c['frames']:
+            frame = dict(fr)
+            frame['words'] = len(frame.pop('text').split())
+            frame['hash'] = next(digests)
+            chapter['frames'].append(frame)
+        manifest['chapters'].append(chapter)
+    writeFileAtomic(getManifestPath(storedir, name), json.dumps(manifest,
+                                                           sort_keys=True))
+    return manifest
+
+def loadManifest(storedir, name):
+    path = getManifestPath(storedir, name)
+    if not os.path.isfile(path):
+        raise ValueError(u'no version {0} in {1}'.format(name, storedir))
+    return json.load(codecs.open(path, 'r', encoding='utf-8'))
+
+def loadVersion(storedir, name):
+    '''
+    Returns version name as the export it was added from.
+    '''
+    jsonlang = loadManifest(storedir, name)
+    f = open(getPackPath(storedir), 'rb')
+    index = getIndex(storedir)
+    for c in jsonlang['chapters']:
+        for fr in c['frames']:
+            del fr['words']
+            offset, length = index[fr.pop('hash')]
+            f.seek(offset)
+            fr['text'] = f.read(length).decode('utf-8')
+    f.close()
+    return jsonlang
+
+def getVersionNames(storedir):
+    versiondir = os.path.join(storedir, 'versions')
+    if not os.path.isdir(versiondir):
+        return []
+    return sorted([x[:-5] for x in os.listdir(versiondir)
+                                                   if x.endswith('.json')])
+
+def getStoreStats(storedir):
+    '''
+    Returns the number of versions, the frames in them all and the texts
+    actually stored.
+    '''
+    names = getVersionNames(storedir)
+    frames = 0
+    for name in names:
+        for c in loadManifest(storedir, name)['chapters']:
+            frames += len(c['frames'])
+    return len(names), frames, len(getIndex(storedir))
+
+def getVersionName(path):
+    name = os.path.basename(path)
+    if name.endswith('.json'):
+        name = name[:-5]
+    if name.startswith('obs-'):
+        name = name[4:]
+    return name
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-s', '--store', dest="store", required=True,
+        help="Store directory")
+    parser.add_argument('-a', '--add', dest="add", default=None,
+        help="Add this OBS JSON file")
+    parser.add_argument('-n', '--name', dest="name", default=None,
+        help="Name for --add (default: the file name without obs- and "
+             ".json)")
+    parser.add_argument('-x', '--export', dest="export", default=None,
+        help="Write this version back out as OBS JSON")
+    parser.add_argument('-o', '--output', dest="output", default=None,
+        help="File for --export (default: standard output)")
+    parser.add_argument('-l', '--list', dest="list", action='store_true',
+        default=False, help="List the versions in the store")
+    args = parser.parse_args(sys.argv[1:])
+    if args.add:
+        name = args.name or getVersionName(args.add)
+        addVersion(args.store, name, json.load(codecs.open(args.add, 'r',
+                                                         encoding='utf-8')))
+        print 'Added {0} as {1}'.format(args.add, name)
+    if args.export:
+        try:
+            dump = getDump(loadVersion(args.store, args.export))
+        except ValueError as e:
+            print e
+            sys.exit(1)
+        if args.output:
+            writeFileAtomic(args.output, dump)
+        else:
+            print dump
+    if args.list:
+        for name in getVersionNames(args.store):
+            print name
+        versions, frames, texts = getStoreStats(args.store)
+        print '{0} versions, {1} frames, {2} texts stored'.format(versions,
+                                                              frames, texts)